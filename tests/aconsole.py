@@ -0,0 +1,290 @@
+import asyncio
+import os
+import re
+import signal
+import termios
+import threading
+import time
+
+import pexpect
+
+import console
+
+
+def compile_pattern(pattern):
+    if pattern is pexpect.EOF or pattern is pexpect.TIMEOUT:
+        return pattern
+    if isinstance(pattern, str):
+        pattern = pattern.encode()
+    if isinstance(pattern, bytes):
+        # same flags pexpect uses for string patterns
+        return re.compile(pattern, re.DOTALL)
+    return pattern
+
+
+class ConsoleProtocol(asyncio.Protocol):
+    def __init__(self, con):
+        self.con = con
+
+    def data_received(self, data):
+        self.con.feed(data)
+
+    def connection_lost(self, exc):
+        # EIO on the pty master once qemu has exited
+        self.con.feed_eof()
+
+
+class AsyncConsole:
+    # the part of the pexpect.spawn API the tests use, as coroutines
+    def __init__(self, timeline=None, fatal=None):
+        self.timeline = console.Timeline() if timeline is None else timeline
+        self.fatal = console.compile_fatal(console.FATAL_PATTERNS if fatal is None else fatal)
+        self.timeout = 30
+        self.logfile = None
+        self.logfile_read = None
+        self.delaybeforesend = None
+        self.buffer = b''
+        self.before = None
+        self.after = None
+        self.match = None
+        self.eof = False
+        self.proc = None
+        self.fd = None
+        self.transport = None
+        self.sync = None
+        self.changed = asyncio.Event()
+
+    async def start(self, command, args):
+        self.fd, child = os.openpty()
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                command, *args, stdin=child, stdout=child, stderr=child,
+                start_new_session=True)
+        finally:
+            os.close(child)
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.connect_read_pipe(
+            lambda: ConsoleProtocol(self), os.fdopen(self.fd, 'rb', buffering=0, closefd=False))
+        return self
+
+    def feed(self, data):
+        for log in (self.logfile_read, self.logfile):
+            if log is not None:
+                log.write(data)
+                log.flush()
+        self.buffer += data
+        self.changed.set()
+
+    def feed_eof(self):
+        self.eof = True
+        self.changed.set()
+
+    def phase(self, name):
+        self.timeline.mark(name)
+
+    def compile_pattern_list(self, patterns):
+        if not isinstance(patterns, list):
+            patterns = [patterns]
+        return [compile_pattern(p) for p in patterns]
+
+    def search(self, compiled):
+        best = None
+        for i, regex in enumerate(compiled):
+            if regex is pexpect.EOF or regex is pexpect.TIMEOUT:
+                continue
+            m = regex.search(self.buffer)
+            # the earliest match wins, like pexpect
+            if m and (best is None or m.start() < best[1].start()):
+                best = (i, m)
+        return best
+
+    def special(self, compiled, which, message):
+        self.before = self.buffer
+        self.after = which
+        self.match = which
+        if which is pexpect.EOF:
+            self.buffer = b''
+        if which in compiled:
+            return compiled.index(which)
+        raise which(message)
+
+    async def expect_list(self, compiled, timeout=-1, phase=None, fatal=True):
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # the callers patterns come first and win if they match at the same place
+        patterns = list(compiled) + ([regex for _, regex in self.fatal] if fatal else [])
+        while True:
+            found = self.search(patterns)
+            if found is not None:
+                i, m = found
+                self.before = self.buffer[:m.start()]
+                self.after = m.group()
+                self.match = m
+                self.buffer = self.buffer[m.end():]
+                if i >= len(compiled):
+                    raise console.GuestFailure(self.fatal[i - len(compiled)][0],
+                                               self.after.decode(errors='replace').strip())
+                break
+            if self.eof:
+                i = self.special(compiled, pexpect.EOF, "End Of File (EOF).")
+                break
+            self.changed.clear()
+            try:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                i = self.special(compiled, pexpect.TIMEOUT, "Timeout exceeded.")
+                break
+        if phase is not None:
+            self.phase(phase)
+        return i
+
+    async def expect(self, pattern, timeout=-1, phase=None, fatal=True):
+        return await self.expect_list(self.compile_pattern_list(pattern), timeout, phase, fatal)
+
+    async def expect_exact(self, pattern_list, timeout=-1, phase=None, fatal=True):
+        if not isinstance(pattern_list, list):
+            pattern_list = [pattern_list]
+        compiled = [p if p is pexpect.EOF or p is pexpect.TIMEOUT
+                    else re.compile(re.escape(p.encode() if isinstance(p, str) else p))
+                    for p in pattern_list]
+        return await self.expect_list(compiled, timeout, phase, fatal)
+
+    async def send(self, s):
+        if isinstance(s, str):
+            s = s.encode()
+        if self.logfile is not None:
+            self.logfile.write(s)
+            self.logfile.flush()
+        os.write(self.fd, s)
+        return len(s)
+
+    async def sendline(self, s=''):
+        return await self.send(s + os.linesep)
+
+    async def send_file(self, path, content, delimiter='__EOF__'):
+        return await self.send(f"cat > {path} <<'{delimiter}'\n{content}{delimiter}\n")
+
+    async def waitnoecho(self, timeout=-1):
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while termios.tcgetattr(self.fd)[3] & termios.ECHO:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    def isalive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def terminate(self, force=False):
+        for sig in (signal.SIGHUP, signal.SIGCONT, signal.SIGINT) + \
+                ((signal.SIGKILL,) if force else ()):
+            if not self.isalive():
+                return True
+            self.proc.send_signal(sig)
+            try:
+                await asyncio.wait_for(self.proc.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+        return not self.isalive()
+
+    async def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+async def spawn(command, args=[], timeline=None, fatal=None):
+    return await AsyncConsole(timeline, fatal).start(command, args)
+
+
+async def gather(coros):
+    return await asyncio.gather(*coros, return_exceptions=True)
+
+
+class EventLoopThread:
+    # one loop for all the VMs of the process
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def gather(self, coros):
+        # runs them concurrently, all of them finish before the first error is raised
+        results = self.run(gather(coros))
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class SyncConsole:
+    # pexpect like adapter so the tests run unchanged on the shared loop
+    def __init__(self, loop, command, args=[], timeline=None, fatal=None):
+        self.loop = loop
+        self.con = loop.run(spawn(command, args, timeline, fatal))
+
+    @classmethod
+    def wrap(cls, loop, con):
+        # the blocking view of a console started on the loop, not usable from the loop,
+        # the same one each time so it can be found in lists
+        if con.sync is None:
+            self = cls.__new__(cls)
+            self.loop = loop
+            self.con = con
+            con.sync = self
+        return con.sync
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    def __setattr__(self, name, value):
+        # attributes set by the callers, like qmp, are visible to both views
+        if name in ('loop', 'con'):
+            super().__setattr__(name, value)
+        else:
+            setattr(self.con, name, value)
+
+    def phase(self, name):
+        self.con.phase(name)
+
+    def expect_list(self, compiled, timeout=-1, phase=None, fatal=True):
+        return self.loop.run(self.con.expect_list(compiled, timeout, phase, fatal))
+
+    def expect(self, pattern, timeout=-1, phase=None, fatal=True):
+        return self.loop.run(self.con.expect(pattern, timeout, phase, fatal))
+
+    def expect_exact(self, pattern_list, timeout=-1, phase=None, fatal=True):
+        return self.loop.run(self.con.expect_exact(pattern_list, timeout, phase, fatal))
+
+    def send(self, s):
+        return self.loop.run(self.con.send(s))
+
+    def sendline(self, s=''):
+        return self.loop.run(self.con.sendline(s))
+
+    def send_file(self, path, content, delimiter='__EOF__'):
+        return self.loop.run(self.con.send_file(path, content, delimiter))
+
+    def waitnoecho(self, timeout=-1):
+        return self.loop.run(self.con.waitnoecho(timeout))
+
+    def terminate(self, force=False):
+        return self.loop.run(self.con.terminate(force))
+
+    def close(self):
+        return self.loop.run(self.con.close())
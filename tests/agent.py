@@ -0,0 +1,91 @@
+import base64
+import collections
+import socket
+import time
+
+import qmp
+
+# name of the virtio-serial port in the guest
+PORT_NAME = 'org.alpinelinux.test.agent'
+
+# one request per line: <id> <base64 script>
+# one reply per line: <id> <exit status> <base64 stdout> <base64 stderr>
+SCRIPT = f'''modprobe virtio_console 2>/dev/null
+for f in /sys/class/virtio-ports/*/name; do
+	[ "$(cat $f)" = {PORT_NAME} ] || continue
+	d=${{f%/name}}
+	port=/dev/${{d##*/}}
+	[ -c $port ] || mknod $port c $(tr : ' ' < $d/dev)
+done
+dir=$(mktemp -d)
+exec 3<>$port
+while read -r id cmd <&3; do
+	echo "$cmd" | base64 -d > $dir/cmd
+	sh $dir/cmd </dev/null >$dir/out 2>$dir/err
+	status=$?
+	echo "$id $status $(base64 -w0 < $dir/out) $(base64 -w0 < $dir/err)" >&3
+done
+'''
+
+Result = collections.namedtuple('Result', 'status stdout stderr')
+
+
+class AgentError(Exception):
+    pass
+
+
+class GuestAgent:
+    def __init__(self, path, timeout=10, alive=None):
+        # the guest side reads EOF until the host is connected, so connect first
+        self.sock = qmp.connect(path, timeout, alive)
+        self.timeout = timeout
+        self.buf = b''
+        self.next_id = 0
+        self.replies = {}
+
+    def send(self, cmd):
+        self.next_id += 1
+        self.sock.sendall(f"{self.next_id} ".encode() + base64.b64encode(cmd.encode()) + b'\n')
+        return self.next_id
+
+    def read(self, deadline):
+        while b'\n' not in self.buf:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("no reply from the guest agent")
+            self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                raise TimeoutError("no reply from the guest agent")
+            if not data:
+                raise EOFError("guest agent connection closed")
+            self.buf += data
+        line, _, self.buf = self.buf.partition(b'\n')
+        fields = line.decode().split(' ')
+        if len(fields) != 4:
+            raise AgentError(f"bad reply from the guest agent: {line!r}")
+        rid, status, out, err = fields
+        self.replies[int(rid)] = Result(int(status), base64.b64decode(out).decode(errors='replace'),
+                                        base64.b64decode(err).decode(errors='replace'))
+
+    def run_many(self, cmds, timeout=None):
+        # all requests go out at once, the guest runs them one after another
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        ids = [self.send(cmd) for cmd in cmds]
+        for rid in ids:
+            while rid not in self.replies:
+                self.read(deadline)
+        return [self.replies.pop(rid) for rid in ids]
+
+    def run(self, cmd, timeout=None):
+        return self.run_many([cmd], timeout)[0]
+
+    def check(self, cmd, timeout=None):
+        result = self.run(cmd, timeout)
+        if result.status != 0:
+            raise AgentError(f"{cmd}: exit status {result.status}: {result.stderr.strip()}")
+        return result.stdout
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,64 @@
+import os
+import shutil
+
+from scheduler import locked
+
+# 9p mount tag of the cache in the guest
+MOUNT_TAG = 'apkcache'
+
+
+def link_or_copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        tmp = dest + '.tmp'
+        shutil.copyfile(src, tmp)
+        os.rename(tmp, dest)
+
+
+class SharedApkCache:
+    # every VM gets its own copy as hardlinks, new packages are merged back
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    def lock(self):
+        return locked(self.path.rstrip('/') + '.lock')
+
+    def stage(self, dest):
+        os.makedirs(dest, exist_ok=True)
+        with self.lock():
+            for name in os.listdir(self.path):
+                src = os.path.join(self.path, name)
+                if os.path.isfile(src):
+                    link_or_copy(src, os.path.join(dest, name))
+                    # mtime is the last use for eviction
+                    os.utime(src)
+        return dest
+
+    def merge(self, stage):
+        if not os.path.isdir(stage):
+            return
+        with self.lock():
+            for name in os.listdir(stage):
+                src = os.path.join(stage, name)
+                dest = os.path.join(self.path, name)
+                if os.path.isfile(src) and not name.endswith('.tmp') and not os.path.exists(dest):
+                    link_or_copy(src, dest)
+            self.evict()
+        shutil.rmtree(stage, ignore_errors=True)
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if os.path.isfile(path):
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            os.unlink(path)
+            total -= size
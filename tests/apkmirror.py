@@ -0,0 +1,58 @@
+import http.server
+import os
+import threading
+
+# the host as seen from qemu user networking
+GUEST_HOST = '10.0.2.2'
+
+
+class RepoHandler(http.server.SimpleHTTPRequestHandler):
+    def translate_path(self, path):
+        # /<repo>/.../<arch>/<file>, setup-apkrepos appends /<branch>/main or
+        # /community to the mirror url and all of them get the same repository
+        parts = path.split('?')[0].split('#')[0].strip('/').split('/')
+        if '/'.join(parts) in self.server.files:
+            return self.server.files['/'.join(parts)]
+        root = self.server.repos.get(parts[0])
+        if root is None or len(parts) < 3 or '..' in parts[-2:]:
+            return os.devnull + '/not-found'
+        return os.path.join(root, *parts[-2:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ApkMirror:
+    def __init__(self, repos=None, host='127.0.0.1'):
+        # name -> directory with <arch>/APKINDEX.tar.gz
+        self.server = http.server.ThreadingHTTPServer((host, 0), RepoHandler)
+        self.server.daemon_threads = True
+        self.server.repos = {} if repos is None else repos
+        self.server.files = {}
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, repo):
+        return f"http://{GUEST_HOST}:{self.server.server_address[1]}/{repo}"
+
+    def add_file(self, name, path):
+        self.server.files[name] = path
+        return self.url(name)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Repositories:
+    # the repositories one VM uses, the first is the mirror
+    def __init__(self, mirror, names):
+        self.mirror = mirror
+        self.names = names
+
+    def url(self):
+        return self.mirror.url(self.names[0])
+
+    @property
+    def urls(self):
+        return [self.mirror.url(name) for name in self.names]
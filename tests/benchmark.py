@@ -0,0 +1,120 @@
+import json
+import os
+import re
+import time
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return None
+    # linear interpolation between closest ranks
+    k = (len(values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return round(values[lo] + (values[hi] - values[lo]) * (k - lo), 3)
+
+
+def io_totals(blockstats):
+    # summed over the drives of all VMs of a test
+    totals = {}
+    for vm in blockstats:
+        for stats in vm['drives'].values():
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def report_name(nodeid):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', nodeid).strip('_') + '.json'
+
+
+class BenchmarkReport:
+    def __init__(self, config):
+        self.config = config
+        self.outdir = config.getoption("--benchmark-dir")
+        self.tests = {}
+
+    def pytest_runtest_logreport(self, report):
+        if hasattr(self.config, 'workerinput'):
+            return
+        props = dict(report.user_properties)
+        test = self.tests.setdefault(report.nodeid, {'nodeid': report.nodeid,
+                                                     'outcome': 'passed'})
+        if report.failed:
+            test['outcome'] = 'failed'
+        elif report.skipped and test['outcome'] == 'passed':
+            test['outcome'] = 'skipped'
+        if report.when == 'teardown' and 'phases' in props:
+            test['phases'] = props['phases']
+            test['total'] = props['total']
+            test['started'] = props['started']
+            if props.get('boot_profiles'):
+                test['boot_profiles'] = props['boot_profiles']
+            if props.get('blockstats'):
+                test['blockstats'] = props['blockstats']
+            if self.outdir:
+                os.makedirs(self.outdir, exist_ok=True)
+                with open(os.path.join(self.outdir, report_name(report.nodeid)), 'w') as f:
+                    json.dump(test, f, indent=1)
+
+    def summary(self):
+        durations = {}
+        totals = []
+        io = {}
+        for test in self.tests.values():
+            if test['outcome'] != 'passed' or 'phases' not in test:
+                continue
+            totals.append(test['total'])
+            if 'blockstats' in test:
+                io[test['nodeid']] = io_totals(test['blockstats'])
+            for phase in test['phases']:
+                durations.setdefault(phase['name'], []).append(phase['duration'])
+
+        def stats(values):
+            return {'count': len(values),
+                    'min': min(values),
+                    'p50': percentile(values, 50),
+                    'p90': percentile(values, 90),
+                    'p95': percentile(values, 95),
+                    'max': max(values)}
+
+        summary = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'iso': self.config.getoption("--iso"),
+                   'alpine_conf_iso': self.config.getoption("--alpine-conf-iso"),
+                   'phases': {name: stats(v) for name, v in durations.items()}}
+        if totals:
+            summary['total'] = stats(totals)
+        if io:
+            summary['io'] = io
+        return summary
+
+    def pytest_sessionfinish(self, session):
+        if hasattr(self.config, 'workerinput') or not self.outdir:
+            return
+        os.makedirs(self.outdir, exist_ok=True)
+        with open(os.path.join(self.outdir, 'summary.json'), 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if hasattr(self.config, 'workerinput') or not self.outdir:
+            return
+        summary = self.summary()
+        if not summary['phases']:
+            return
+        terminalreporter.write_sep('-', 'phase timings (passed tests)')
+        terminalreporter.write_line(f"{'phase':40} {'count':>5} {'p50':>8} {'p95':>8} {'max':>8}")
+        for name, s in sorted(summary['phases'].items(), key=lambda i: -i[1]['p95']):
+            terminalreporter.write_line(
+                f"{name[:40]:40} {s['count']:5} {s['p50']:8.2f} {s['p95']:8.2f} {s['max']:8.2f}")
+        if summary.get('io'):
+            terminalreporter.write_sep('-', 'disk I/O (passed tests)')
+            terminalreporter.write_line(
+                f"{'test':50} {'MB written':>10} {'writes':>8} {'flushes':>8} {'flush ms':>8}")
+            for nodeid, t in sorted(summary['io'].items(), key=lambda i: -i[1]['wr_bytes']):
+                flush_ms = t['flush_total_time_ns'] / max(t['flush_operations'], 1) / 1e6
+                terminalreporter.write_line(
+                    f"{nodeid[-50:]:50} {t['wr_bytes'] / 2**20:10.1f} {t['wr_operations']:8} "
+                    f"{t['flush_operations']:8} {flush_ms:8.2f}")
+        terminalreporter.write_line(
+            f"report written to {os.path.join(self.outdir, 'summary.json')}")
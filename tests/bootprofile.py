@@ -0,0 +1,118 @@
+import bisect
+import re
+import time
+
+# terminal escape sequences OpenRC uses to colour its output
+E = r'(?:\x1b\[[0-9;]*[A-Za-z])*'
+
+PRINTK = re.compile(r'^\[\s*(\d+\.\d+)\] (.*)$', re.M)
+BEGIN = re.compile(rf'{E}\*{E} ([^\r\n\x1b]+?) \.\.\.')
+END = re.compile(rf'\[{E}\s*{E}(ok|!!){E}\s*{E}\]')
+OPENRC = re.compile(r'OpenRC [^\r\n]* is starting up')
+LOGIN = re.compile(r'login: ')
+
+
+class ConsoleRecorder:
+    # used as pexpect logfile_read, remembers when each chunk arrived
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.offsets = []
+        self.times = []
+        self.data = bytearray()
+
+    def write(self, data):
+        self.offsets.append(len(self.data))
+        self.times.append(time.monotonic() - self.t0)
+        self.data += data
+
+    def flush(self):
+        pass
+
+    def time_at(self, offset):
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        return self.times[max(i, 0)]
+
+    def text(self):
+        # latin-1 keeps string offsets equal to byte offsets
+        return self.data.decode('latin-1')
+
+    def profile(self):
+        return parse(self.text(), self.time_at)
+
+
+def attach(p):
+    rec = ConsoleRecorder()
+    p.logfile_read = rec
+    return rec
+
+
+def steps(text, time_at, start, end):
+    result = {}
+    for m in BEGIN.finditer(text, start, end):
+        done = END.search(text, m.end(), end)
+        if done is None:
+            continue
+        name = m.group(1).strip()
+        key, n = name, 1
+        while key in result:
+            n += 1
+            key = f"{name} #{n}"
+        result[key] = round(time_at(done.start()) - time_at(m.start()), 3)
+    return result
+
+
+def parse(text, time_at):
+    profile = {}
+    kernel_end = None
+    for m in PRINTK.finditer(text):
+        if 'Run /init as init process' in m.group(2):
+            profile['kernel'] = float(m.group(1))
+            kernel_end = m.end()
+            break
+
+    login = LOGIN.search(text)
+    end = login.start() if login else len(text)
+    if login:
+        profile['login'] = round(time_at(login.start()), 3)
+
+    openrc = OPENRC.search(text)
+    openrc_start = openrc.start() if openrc else 0
+    if openrc and kernel_end is not None:
+        profile['initramfs'] = round(time_at(openrc.start()) - time_at(kernel_end), 3)
+    if openrc:
+        profile['initramfs_steps'] = steps(text, time_at, kernel_end or 0, openrc.start())
+        profile['openrc'] = round(time_at(end) - time_at(openrc.start()), 3)
+
+    services = steps(text, time_at, openrc_start, end)
+    profile['services'] = services
+    for name, duration in services.items():
+        if name.startswith('Mounting modloop'):
+            profile['modloop'] = duration
+    return profile
+
+
+def flatten(profile):
+    flat = {k: v for k, v in profile.items() if isinstance(v, (int, float))}
+    for name, duration in profile.get('initramfs_steps', {}).items():
+        flat['initramfs: ' + name] = duration
+    for name, duration in profile.get('services', {}).items():
+        flat['service: ' + name] = duration
+    return flat
+
+
+def median_profile(profiles):
+    flat = [flatten(p) for p in profiles]
+    result = {}
+    for key in set().union(*flat):
+        values = sorted(f[key] for f in flat if key in f)
+        result[key] = values[len(values) // 2]
+    return result
+
+
+def regressions(profile, baseline, threshold):
+    found = []
+    for key, value in sorted(profile.items()):
+        base = baseline.get(key)
+        if base is not None and value - base > threshold:
+            found.append((key, base, value))
+    return found
@@ -1,16 +1,128 @@
-import libarchive
+import aconsole
+import agent
+import apkcache
+import apkmirror
+import asyncio
+import benchmark
+import bootprofile
+import console
+import covering
+import durations
+import install
+import isocache
 import os
+import pexpect
 import platform
 import pytest
+import qmp
+import resultcache
+import scheduler
+import subprocess
+import tempfile
+import time
+import timeouts
+import warmpool
 
 def pytest_addoption(parser):
-    parser.addoption("--iso", action="store", help="iso image to test")
+    parser.addoption("--iso", action="append", default=[],
+                     help="iso image to test, more than one runs every test for each of them")
     parser.addoption("--alpine-conf-iso", action="store", help='optional iso image with alpine-conf')
+    parser.addoption("--boot-snapshots", action="store_true",
+                     help='boot the live iso once and resume tests from a saved VM state')
+    parser.addoption("--direct-kernel-boot", action="store_true",
+                     help='boot the live iso with the extracted kernel and initramfs, skipping firmware and bootloader')
+    parser.addoption("--disk-format", action="store", default='qcow2', choices=['qcow2', 'raw'],
+                     help='format of the per test disk images (default: qcow2)')
+    parser.addoption("--disk-size", action="store", default='1G',
+                     help='size of the disk images (default: 1G)')
+    parser.addoption("--accel", action="store", default='auto',
+                     choices=['auto', 'kvm', 'hvf', 'tcg'],
+                     help='qemu accelerator, auto uses kvm or hvf when the host can run '
+                          'the iso arch with it, tcg otherwise (default: auto)')
+    parser.addoption("--disk-profile", action="store", default='throwaway',
+                     choices=sorted(DISK_PROFILES),
+                     help='qemu cache and I/O settings of the disks, a disk_profile marker '
+                          'overrides it per test (default: throwaway)')
+    parser.addoption("--warm-pool", action="store", type=int, default=0, metavar='N',
+                     help='boot the live VMs of the next N tests marked live_vm while the '
+                          'current one runs, without xdist and --boot-snapshots (default: 0)')
+    parser.addoption("--max-vms", action="store", type=int,
+                     help='maximum number of VMs running at the same time on this host')
+    parser.addoption("--vm-cpus", action="store", type=int,
+                     help='number of host CPUs VMs may use (default: all)')
+    parser.addoption("--vm-memory", action="store",
+                     help='host memory VMs may use (default: total memory minus 2G)')
+    parser.addoption("--baseline-iso", action="store",
+                     help='iso image to compare the boot profile of --iso against')
+    parser.addoption("--boot-profile-runs", action="store", type=int, default=3,
+                     help='number of boots to profile per iso (default: 3)')
+    parser.addoption("--boot-regression-threshold", action="store", type=float, default=1.0,
+                     help='seconds a boot step may be slower than with --baseline-iso (default: 1.0)')
+    parser.addoption("--benchmark-dir", action="store",
+                     help='write per test phase timings and a summary as json to this directory')
+    parser.addoption("--no-duration-order", action="store_false", dest="duration_order",
+                     help='run the tests in collection order instead of longest first')
+    parser.addoption("--console-driver", action="store", default='pexpect',
+                     choices=['pexpect', 'asyncio'],
+                     help='drive the serial consoles with pexpect or from one asyncio event loop, '
+                          'which test_concurrent_install uses to run many installs at once')
+    parser.addoption("--fatal-pattern", action="append", default=[], metavar="[NAME=]REGEX",
+                     help='fail a test as soon as the console shows this (may be repeated)')
+    parser.addoption("--no-default-fatal-patterns", action="store_false",
+                     dest="default_fatal_patterns",
+                     help='only watch for the --fatal-pattern patterns')
+    parser.addoption("--timeout-factor", action="store", type=float, default=3.0,
+                     help='wait this many times the recorded p95 of a phase (default: 3.0)')
+    parser.addoption("--no-adaptive-timeouts", action="store_false", dest="adaptive_timeouts",
+                     help='use the fixed timeouts of the tests')
+    parser.addoption("--combinations", action="store", default='full',
+                     choices=['full', 'covering'],
+                     help='run every parameter combination or a covering array of them')
+    parser.addoption("--covering-strength", action="store", type=int, default=2,
+                     help='cover all combinations of this many parameters (default: 2, pairwise)')
+    parser.addoption("--reuse-results", action="store_true",
+                     help='skip tests that passed before with the same isos, tests, qemu and firmware')
+    parser.addoption("--result-max-age", action="store", type=float, default=7,
+                     help='days a passed result may be reused (default: 7)')
+    parser.addoption("--local-apk-mirror", action="store_true",
+                     help='serve the apks of the iso to the VMs instead of using a network mirror')
+    parser.addoption("--apk-repo", action="store", metavar="DIR",
+                     help='extra local apk repository for the VMs, implies --local-apk-mirror')
+    parser.addoption("--shared-apk-cache", action="store", metavar="DIR",
+                     help='apk cache shared by all VMs of the live system, kept between runs')
+    parser.addoption("--apk-cache-size", action="store", default='2G',
+                     help='evict the least recently used packages above this size (default: 2G)')
+    parser.addoption("--setup-mode", action="store", default='auto',
+                     choices=['auto', 'interactive', 'answerfile'],
+                     help='answer setup-alpine prompts interactively or pass an answer file '
+                     '(default: auto, interactive for one install variant only)')
 
 
+def pytest_configure(config):
+    config.addinivalue_line("markers", "disk_profile(name): qemu disk settings for the test")
+    config.addinivalue_line("markers", "live_vm: the test starts with boot_live on blank disks")
+    config.pluginmanager.register(durations.DurationHistory(config), 'installer-durations')
+    config.pluginmanager.register(benchmark.BenchmarkReport(config), 'installer-benchmark')
+    config.pluginmanager.register(timeouts.TimeoutModel(config), 'installer-timeouts')
+    config.pluginmanager.register(covering.CoveringSelection(config, vm_arch),
+                                  'installer-covering')
+    config.pluginmanager.register(resultcache.ResultCache(config, result_inputs),
+                                  'installer-results')
+
+
+def pytest_generate_tests(metafunc):
+    # with several isos every test runs once per iso, one iso keeps the test ids as they were
+    isos = metafunc.config.getoption("--iso")
+    if len(isos) > 1 and 'iso_file' in metafunc.fixturenames:
+        metafunc.parametrize('iso_file', [os.path.realpath(iso) for iso in isos],
+                             ids=[os.path.basename(iso) for iso in isos],
+                             indirect=True, scope='session')
+
 @pytest.fixture(scope='session')
 def iso_file(request):
-    return os.path.realpath(request.config.getoption("--iso"))
+    if hasattr(request, 'param'):
+        return request.param
+    return os.path.realpath(request.config.getoption("--iso")[0])
 
 @pytest.fixture(scope='session')
 def alpine_conf_iso(request):
@@ -19,22 +131,133 @@ def alpine_conf_iso(request):
         return None
     return os.path.realpath(iso)
 
+def cache_dir(config, name):
+    if getattr(config, 'cache', None) is None:
+        # cacheprovider plugin disabled
+        path = os.path.join(tempfile.gettempdir(), 'alpine-installer-testsuite', name)
+        os.makedirs(path, exist_ok=True)
+        return path
+    return str(config.cache.mkdir(name))
+
+def session_tmp_path(tmp_path_factory, name):
+    root = tmp_path_factory.getbasetemp()
+    if os.environ.get('PYTEST_XDIST_WORKER'):
+        # shared between the xdist workers of this run
+        root = root.parent
+    path = root / name
+    path.mkdir(exist_ok=True)
+    return path
+
+@pytest.fixture(scope='session')
+def iso_index(request, iso_file):
+    return isocache.load(iso_file, cache_dir(request.config, 'iso'))
+
+def qemu_arch(iso_arch):
+    if iso_arch == 'x86':
+        return 'i386'
+    if iso_arch == 'armv7' or iso_arch == 'armhf':
+        return 'arm'
+    return iso_arch
+
+def vm_arch(config, iso=None):
+    if iso is None:
+        isos = config.getoption("--iso")
+        if not isos:
+            return None, False
+        iso = isos[0]
+    index = isocache.load(os.path.realpath(iso), cache_dir(config, 'iso'))
+    return qemu_arch(index['arch']), index['xen']
+
+# qemu archs the host cpu runs with kvm or hvf
+NATIVE_ARCHS = {
+    'x86_64': ('x86_64', 'i386'),
+    'amd64': ('x86_64', 'i386'),
+    'aarch64': ('aarch64',),
+    'arm64': ('aarch64',),
+}
+
+# cpu models when emulating, pauth makes -cpu max slow on tcg for aarch64
+TCG_CPUS = {'x86_64': 'max', 'i386': 'max', 'aarch64': 'cortex-a57', 'arm': 'cortex-a15'}
+
+# translation block cache of tcg in MiB, qemu defaults to 1G per VM
+TCG_TB_SIZE = 256
+
+# the xen dom0 needs more than the default
+XEN_MEMORY = '768M'
+
+def select_accel(arch, accel='auto'):
+    if accel != 'auto':
+        return accel
+    if arch not in NATIVE_ARCHS.get(platform.machine().lower(), ()):
+        return 'tcg'
+    if platform.system() == 'Linux' and os.access('/dev/kvm', os.R_OK | os.W_OK):
+        return 'kvm'
+    if platform.system() == 'Darwin':
+        return 'hvf'
+    return 'tcg'
+
+def uefi_code(arch):
+    if platform.system() == 'Darwin':
+        edk2_path = '/opt/homebrew/share/qemu'
+    else:
+        edk2_path = '/usr/share/qemu'
+    return edk2_path+'/edk2-'+arch+'-code.fd'
+
+def qemu_version(prog):
+    try:
+        out = subprocess.run([prog, '--version'], capture_output=True, text=True).stdout
+    except FileNotFoundError:
+        return None
+    return out.splitlines()[0] if out else None
+
+def result_inputs(config):
+    # everything besides the test code a test result depends on
+    isos = config.getoption("--iso")
+    if not isos:
+        return None
+    cachedir = cache_dir(config, 'iso')
+    arches = [vm_arch(config, iso)[0] for iso in isos]
+    alpine_conf_iso = config.getoption("--alpine-conf-iso")
+    firmwares = [uefi_code(arch) for arch in arches]
+    return {
+        'iso': [isocache.iso_hash(os.path.realpath(iso), cachedir) for iso in isos],
+        'alpine_conf_iso': alpine_conf_iso and isocache.iso_hash(os.path.realpath(alpine_conf_iso),
+                                                                 cachedir),
+        'qemu': [qemu_version("qemu-system-"+arch) for arch in arches],
+        'accel': [select_accel(arch, config.getoption("--accel")) for arch in arches],
+        'firmware': [isocache.file_hash(firmware) if os.path.exists(firmware) else None
+                     for firmware in firmwares],
+        'options': [config.getoption(name) for name in (
+            "--direct-kernel-boot", "--disk-format", "--disk-size", "--disk-profile",
+            "--setup-mode",
+            "--local-apk-mirror", "--apk-repo")],
+    }
+
+def get_boot_files(iso, index):
+    flavor = sorted(index['kernels'])[0]
+    kernel = index['kernels'][flavor]
+    return {'kernel': kernel['kernel'], 'initrd': kernel['initrd'], 'iso': iso,
+            'index': index}
+
 @pytest.fixture(scope='session')
-def boot_files(tmpdir_factory, iso_file):
-    with libarchive.file_reader(iso_file) as a:
-        outdir = tmpdir_factory.mktemp('data')
-        os.chdir(outdir)
-        for entry in a:
-            entry.perm=0o640
-            if entry.pathname.startswith("boot/vmlinuz"):
-                kernel = str(outdir.join(entry.pathname))
-                libarchive.extract.extract_entries([entry])
+def boot_files(iso_file, iso_index):
+    return get_boot_files(iso_file, iso_index)
+
+@pytest.fixture(scope='session')
+def baseline_boot_files(request):
+    iso = request.config.getoption("--baseline-iso")
+    if not iso:
+        return None
+    iso = os.path.realpath(iso)
+    return get_boot_files(iso, isocache.load(iso, cache_dir(request.config, 'iso')))
 
-            if entry.pathname.startswith("boot/initramfs"):
-                initrd = str(outdir.join(entry.pathname))
-                libarchive.extract.extract_entries([entry])
 
-    return {'kernel': kernel, 'initrd': initrd, 'iso': iso_file}
+def parse_size(size):
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    size = str(size).upper().rstrip('B')
+    if size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
 
 
 def create_disk_image(path, size=1024*1024*1024):
@@ -43,49 +266,831 @@ def create_disk_image(path, size=1024*1024*1024):
         f.write(b'\0'*1024)
     return path
 
-class QemuVM:
-    def __init__(self, iso, tmp_path, numdisks, boot_files):
-        self.iso_arch = os.path.splitext(iso)[0].split('-')[-1]
 
-        if self.iso_arch == 'x86':
-            self.arch = 'i386'
-        elif self.iso_arch == 'armv7' or self.iso_arch == 'armhf':
-            self.arch = 'arm'
-        else:
-            self.arch = self.iso_arch
+# qemu drive options, and whether virtio disks get their own iothread
+DISK_PROFILES = {
+    # the images are deleted after the test, flushing them to the host disk only costs time
+    'throwaway': {
+        # io_uring falls back to threads where qemu or the host lacks it
+        'drive': {'cache': 'unsafe', 'aio': 'io_uring', 'discard': 'unmap', 'detect-zeroes': 'unmap'},
+        'iothread': True,
+    },
+    # what a real machine does, every flush of the guest reaches the host disk
+    'faithful': {
+        'drive': {'cache': 'writeback', 'aio': 'threads'},
+        'iothread': False,
+    },
+}
 
+# counters of query-blockstats kept per drive
+BLOCKSTATS = ('rd_bytes', 'wr_bytes', 'rd_operations', 'wr_operations', 'flush_operations',
+              'unmap_operations', 'rd_total_time_ns', 'wr_total_time_ns', 'flush_total_time_ns')
+
+
+# io_uring support per qemu binary, probed once
+IO_URING = {}
+
+
+def io_uring_supported(prog):
+    # qemu needs liburing at build time and the host kernel may forbid io_uring
+    if prog not in IO_URING:
+        supported = False
         if platform.system() == 'Linux':
-            self.accel = 'kvm'
-        elif platform.system() == 'Darwin':
-            self.accel = 'hvf'
+            with tempfile.NamedTemporaryFile() as f:
+                try:
+                    supported = subprocess.run(
+                        [prog, '-machine', 'none', '-nodefaults', '-display', 'none',
+                         '-monitor', 'stdio',
+                         '-drive', f'if=none,format=raw,file={f.name},aio=io_uring'],
+                        input='quit\n', capture_output=True, text=True, timeout=30
+                    ).returncode == 0
+                except (FileNotFoundError, subprocess.TimeoutExpired):
+                    pass
+        IO_URING[prog] = supported
+    return IO_URING[prog]
+
+
+def image_format(path):
+    if str(path).endswith('.qcow2'):
+        return 'qcow2'
+    return 'raw'
+
+
+class DiskImages:
+    def __init__(self, path, fmt='qcow2', size='1G'):
+        self.path = path
+        self.format = fmt
+        self.size = parse_size(size)
+        self.templates = {}
+
+    def template(self, fstype=None, label=None):
+        key = (fstype, label)
+        if key not in self.templates:
+            name = '-'.join(k for k in key if k) or 'blank'
+            img = self.path / f"{name}.img"
+            with scheduler.locked(f"{img}.lock"):
+                if not os.path.exists(img):
+                    tmp = create_disk_image(f"{img}.tmp", self.size)
+                    if fstype is not None:
+                        labelopts = []
+                        if label is not None:
+                            labelopts = ['-n', label] if fstype == 'vfat' else ['-L', label]
+                        try:
+                            subprocess.run(['mkfs.'+fstype] + labelopts + [tmp],
+                                           check=True, stdout=subprocess.DEVNULL)
+                        except BaseException:
+                            os.unlink(tmp)
+                            raise
+                    os.rename(tmp, img)
+            self.templates[key] = img
+        return self.templates[key]
+
+    def clone(self, template, path):
+        if self.format == 'qcow2':
+            img = f"{path}.qcow2"
+            subprocess.run(['qemu-img', 'create', '-q', '-f', 'qcow2',
+                            '-F', image_format(template), '-b', str(template), img], check=True)
+        else:
+            img = f"{path}.img"
+            subprocess.run(['cp', '--reflink=auto', '--sparse=always', str(template), img],
+                           check=True)
+        return img
+
+
+@pytest.fixture(scope='session')
+def disk_images(request, tmp_path_factory):
+    return DiskImages(session_tmp_path(tmp_path_factory, 'templates'),
+                      request.config.getoption("--disk-format"),
+                      request.config.getoption("--disk-size"))
+
+
+class SnapshotStore:
+    def __init__(self, path, enabled):
+        self.path = path
+        self.enabled = enabled
+        self.states = {}
+
+    def key(self, qemu, disktype, bootmode, alpine_conf_iso):
+        # migration requires the same device topology on both ends
+        # and the saved guest is the one of this iso
+        return (qemu.boot['index']['sha256'][:16], qemu.arch, qemu.accel, bootmode,
+                qemu.machine, disktype, len(qemu.images), qemu.memory, qemu.smp,
+                qemu.disk_profile, alpine_conf_iso)
+
+    def save(self, qemu, key, disktype, bootmode, alpine_conf_iso):
+        name = '-'.join(str(k) for k in key[:-1])
+        if alpine_conf_iso is not None:
+            name += '-alpineconf'
+        statedir = self.path / name
+        state = statedir / 'state'
+        with scheduler.locked(f"{statedir}.lock"):
+            if state.exists():
+                # saved by another worker
+                return state
+            statedir.mkdir(exist_ok=True)
+
+            images = [qemu.disk_images.clone(qemu.disk_images.template(), statedir / f"disk{i}")
+                      for i in range(len(qemu.images))]
+
+            with qemu.timeline.section('snapshot'):
+                p = qemu.spawn(qemu.live_args(disktype, bootmode, alpine_conf_iso, images))
+                qemu.live_login(p, alpine_conf_iso)
+
+                p.qmp.execute('migrate', uri=f'exec:cat > {state}.tmp')
+                while True:
+                    status = p.qmp.execute('query-migrate').get('status')
+                    if status == 'completed':
+                        break
+                    if status in ('failed', 'cancelled'):
+                        raise qmp.QMPError(f"snapshot migration {status}")
+                    time.sleep(0.1)
+                qemu.quit(p)
+                p.phase('save')
+
+            for img in images:
+                os.unlink(img)
+            os.rename(f"{state}.tmp", state)
+        return state
+
+    def restore(self, qemu, disktype, bootmode, alpine_conf_iso):
+        key = self.key(qemu, disktype, bootmode, alpine_conf_iso)
+        if key not in self.states:
+            self.states[key] = self.save(qemu, key, disktype, bootmode, alpine_conf_iso)
+
+        p = qemu.spawn(qemu.live_args(disktype, bootmode, alpine_conf_iso) + [
+            '-incoming', f'exec:cat {self.states[key]}'])
+        p.sendline()
+        p.expect("localhost:~#", timeout=qemu.timeout(30, 'snapshot restore'),
+                 phase='snapshot restore')
+        # the disks attached now are not the ones the guest saw at boot
+        p.sendline("sync && echo 3 > /proc/sys/vm/drop_caches")
+        p.expect("localhost:~#", timeout=qemu.timeout(10))
+        p.timeout = qemu.timeout(2)
+        return p
+
+
+@pytest.fixture(scope='session')
+def vm_snapshots(request, tmp_path_factory):
+    return SnapshotStore(session_tmp_path(tmp_path_factory, 'snapshots'),
+                         request.config.getoption("--boot-snapshots"))
+
+
+class InstallStore:
+    # the disks of a finished install, for the tests of the installed system
+    def __init__(self, path):
+        self.path = path
+
+    def name(self, qemu, params):
+        iso = os.path.splitext(os.path.basename(qemu.boot['iso']))[0]
+        return '-'.join([iso, qemu.disk_images.format, str(len(qemu.images))] +
+                        [str(params[k]) or 'none' for k in sorted(params)])
+
+    def images(self, statedir):
+        if not (statedir / 'done').exists():
+            return None
+        return sorted(str(img) for img in statedir.iterdir() if img.name.startswith('disk'))
+
+    def save(self, qemu, statedir):
+        statedir.mkdir(exist_ok=True)
+        for img in qemu.images:
+            # a qcow2 copy still points at its template
+            subprocess.run(['cp', '--reflink=auto', '--sparse=always', str(img),
+                            str(statedir / os.path.basename(img))], check=True)
+        (statedir / 'done').touch()
+
+    def put(self, qemu, params):
+        # qemu must not hold a reservation, get() waits for one with the lock held
+        statedir = self.path / self.name(qemu, params)
+        with scheduler.locked(f"{statedir}.lock"):
+            if self.images(statedir) is None:
+                self.save(qemu, statedir)
+
+    def get(self, qemu, params, install):
+        # installs with qemu if no test did it yet
+        statedir = self.path / self.name(qemu, params)
+        with scheduler.locked(f"{statedir}.lock"):
+            images = self.images(statedir)
+            if images is None:
+                if (statedir / 'failed').exists():
+                    pytest.fail("the install of this configuration failed before")
+                try:
+                    install()
+                except BaseException:
+                    statedir.mkdir(exist_ok=True)
+                    (statedir / 'failed').touch()
+                    raise
+                self.save(qemu, statedir)
+                images = self.images(statedir)
+        return images
+
+@pytest.fixture(scope='session')
+def install_store(tmp_path_factory):
+    return InstallStore(session_tmp_path(tmp_path_factory, 'installs'))
+
+
+class QemuVM:
+    def __init__(self, iso, tmp_path, numdisks, boot_files, disk_images, snapshots=None,
+                 direct_kernel_boot=False, scheduler=None, console_loop=None,
+                 fatal_patterns=None, timeout_model=None, apk_mirror=None, apk_cache=None,
+                 alpine_conf_url=None, disk_profile='throwaway', accel='auto'):
+        self.iso_arch = boot_files['index']['arch']
+        self.xen = boot_files['index']['xen']
+
+        self.arch = qemu_arch(self.iso_arch)
+
+        self.accel = select_accel(self.arch, accel)
 
         highmemopt = ''
         if self.arch == 'i386' or self.arch == 'x86_64':
             self.machine = 'q35'
             self.console = 'ttyS0'
+            pvpanic = 'pvpanic'
         elif self.arch == 'aarch64' or self.arch == 'arm':
             self.machine = 'virt'
             self.console = 'ttyAMA0'
-            if platform.system() == 'Darwin':
+            pvpanic = 'pvpanic-pci'
+            if self.accel == 'hvf':
                 highmemopt = ',highmem=off'
 
-        self.machine_args = ['-machine', self.machine+',accel='+self.accel+highmemopt, '-cpu', 'host']
-        self.prog = "qemu-system-"+self.arch
-
-        if platform.system() == 'Darwin':
-            edk2_path = '/opt/homebrew/share/qemu'
+        if self.accel == 'tcg':
+            accel_args = ['-accel', f'tcg,thread=multi,tb-size={TCG_TB_SIZE}',
+                          '-cpu', TCG_CPUS[self.arch]]
+            # the translation cache comes on top of the guest memory
+            self.accel_memory = TCG_TB_SIZE * 1024 * 1024
         else:
-            edk2_path = '/usr/share/qemu'
+            accel_args = ['-accel', self.accel, '-cpu', 'host']
+            self.accel_memory = 0
+
+        # pvpanic lets a kernel panic show up as GUEST_PANICKED event
+        self.machine_args = ['-machine', self.machine+highmemopt] + accel_args + [
+            '-device', pvpanic]
+        self.prog = "qemu-system-"+self.arch
+        # before any reservation, live_key() and the warm pool see it too
+        self.memory = XEN_MEMORY if self.xen else '512M'
+        self.smp = 4
 
-        self.uefi_code = edk2_path+'/edk2-'+self.arch+'-code.fd'
+        self.uefi_code = uefi_code(self.arch)
 
+        self.tmp_path = tmp_path
+        self.disk_images = disk_images
+        self.disk_profile = disk_profile
+        self.blockstats = []
         self.images = []
+        self.formatted = None
         for i in range(numdisks):
-            self.images.append(create_disk_image(tmp_path / f"disk{i}.img"))
+            self.images.append(disk_images.clone(disk_images.template(), tmp_path / f"disk{i}"))
 
         self.boot = boot_files
+        self.snapshots = snapshots
+        # xen isos boot the hypervisor from the bootloader
+        self.direct_kernel_boot = direct_kernel_boot and not self.xen
+        self.scheduler = scheduler
+        self.console_loop = console_loop
+        self.fatal_patterns = fatal_patterns
+        self.timeout_model = timeout_model
+        self.apk_mirror = apk_mirror
+        self.apk_cache = apk_cache
+        self.apk_cache_stage = None
+        self.alpine_conf_url = alpine_conf_url
+        self.warm_pool = None
+        # the xen dom0 kernel gets no working virtio devices
+        self.agent_supported = not self.xen
+        self.reservation = None
+        self.procs = []
+        self.timeline = console.Timeline()
+        self.boot_recorders = []
+
+    def disk_args(self, disktype, images=None, snapshot=False):
+        # shared images, like the iso, get the writes of the guest in a temporary
+        # overlay and none of the profile
+        profile = DISK_PROFILES[self.disk_profile]
+        drive = dict(profile['drive'])
+        if drive.get('aio') == 'io_uring' and not io_uring_supported(self.prog):
+            drive['aio'] = 'threads'
+        options = ''.join(f',{k}={v}' for k, v in drive.items())
+        if snapshot:
+            # not readonly=on, ide-hd refuses that and a cdrom would boot another way
+            options = ',snapshot=on'
+        iothread = profile['iothread'] and disktype == 'virtio' and not snapshot
+        args = ['-object', 'iothread,id=iothread0'] if iothread else []
+        for img in self.images if images is None else images:
+            driveid = os.path.splitext(os.path.basename(img))[0]
+            fmt = image_format(img)
+            drive = f'id={driveid},format={fmt},file={img}{options}'
+            if disktype == 'nvme':
+                args.extend([
+                    '-drive', f'if=none,{drive}',
+                    '-device', f'nvme,serial={driveid},drive={driveid}'
+                ])
+            elif disktype == 'usb':
+                args.extend([
+                    '-drive', f'if=none,{drive}',
+                    '-device', 'qemu-xhci',
+                    '-device', f'usb-storage,drive={driveid}',
+                ])
+            elif iothread:
+                args.extend([
+                    '-drive', f'if=none,{drive}',
+                    '-device', f'virtio-blk-pci,drive={driveid},iothread=iothread0',
+                ])
+            else:
+                args.extend(
+                    ['-drive', f'if={disktype},{drive}'])
+        return args
+
+    def format_disks(self, fstype, label=None):
+        self.formatted = (fstype, label)
+        for i, img in enumerate(self.images):
+            os.unlink(img)
+            # only create label on the first
+            template = self.disk_images.template(fstype, label if i == 0 else None)
+            self.images[i] = self.disk_images.clone(template, self.tmp_path / f"disk{i}")
+
+    def use_disks(self, images):
+        # copy on write clones, the tests may change them
+        self.formatted = ('installed', tuple(images))
+        for img in self.images:
+            os.unlink(img)
+        self.images = [self.disk_images.clone(img, self.tmp_path / f"disk{i}")
+                       for i, img in enumerate(images)]
+
+    def remove_disks(self):
+        for img in self.images:
+            if os.path.exists(img):
+                os.unlink(img)
+
+    def firmware_args(self, bootmode):
+        if bootmode == 'UEFI':
+            return ['-drive', 'if=pflash,format=raw,readonly=on,file='+self.uefi_code]
+        return []
+
+    def args(self, disktype, bootmode, images=None, snapshot=False):
+        return self.machine_args + [
+            '-nographic',
+            '-m', self.memory,
+            '-smp', str(self.smp),
+        ] + self.disk_args(disktype, images, snapshot) + self.firmware_args(bootmode)
+
+    def kernel_args(self, cmdline='', quiet=True):
+        kernel = self.boot['kernel']
+        append = 'modules=loop,squashfs,sd-mod,usb-storage'
+        if quiet:
+            append += ' quiet'
+        append += ' console='+self.console
+        flavor = os.path.basename(kernel).partition('-')[2]
+        if flavor:
+            append = 'modloop=/boot/modloop-'+flavor+' '+append
+        if cmdline:
+            append += ' '+cmdline
+        return ['-kernel', kernel, '-initrd', self.boot['initrd'], '-append', append]
+
+    def live_args(self, disktype, bootmode, alpine_conf_iso=None, images=None):
+        args = self.args(disktype, bootmode, images) + [
+            '-boot', 'd',
+            '-cdrom', self.boot['iso'],
+        ]
+        if self.injects_alpine_conf(alpine_conf_iso):
+            args.extend(self.kernel_args(f'ip=dhcp apkovl={self.alpine_conf_url}'))
+        else:
+            if self.direct_kernel_boot:
+                args.extend(self.kernel_args())
+            args.extend(self.alpine_conf_args(alpine_conf_iso))
+        if self.apk_cache is not None:
+            if self.apk_cache_stage is None:
+                self.apk_cache_stage = self.apk_cache.stage(str(self.tmp_path / 'apkcache'))
+            args.extend(['-virtfs', f'local,path={self.apk_cache_stage},'
+                         f'mount_tag={apkcache.MOUNT_TAG},security_model=none,id=apkcache'])
+        return args
+
+    def injects_alpine_conf(self, alpine_conf_iso):
+        return (alpine_conf_iso is not None and self.alpine_conf_url is not None
+                and self.direct_kernel_boot)
+
+    def alpine_conf_args(self, alpine_conf_iso):
+        # for login() to copy from
+        if alpine_conf_iso is None:
+            return []
+        return ['-drive', 'media=cdrom,readonly=on,file='+alpine_conf_iso]
+
+    def live_login(self, p, alpine_conf_iso=None):
+        # the initramfs already applied the apkovl
+        if self.injects_alpine_conf(alpine_conf_iso):
+            alpine_conf_iso = None
+        return self.login(p, alpine_conf_iso)
+
+    def mount_apk_cache(self, p):
+        # after the snapshot, a mounted 9p share blocks migration
+        p.sendline(f"modprobe 9pnet_virtio; mkdir -p /var/cache/apk && "
+                   f"mount -t 9p -o trans=virtio,version=9p2000.L {apkcache.MOUNT_TAG} "
+                   f"/var/cache/apk && ln -sfn /var/cache/apk /etc/apk/cache && echo OK")
+        p.expect("OK")
+        p.expect("localhost:~#", phase='apk cache')
+
+    def save_apk_cache(self):
+        if self.apk_cache_stage is not None:
+            self.apk_cache.merge(self.apk_cache_stage)
+            self.apk_cache_stage = None
+
+    @property
+    def mirror_url(self):
+        # answer to the setup-alpine mirror prompt, None for the default
+        return self.apk_mirror.url() if self.apk_mirror is not None else None
+
+    def apkrepos_args(self):
+        if self.apk_mirror is None:
+            return '-1'
+        return ' '.join(self.apk_mirror.urls)
+
+    def reserve(self, wait=True):
+        # one VM runs at a time per test, so hold a single reservation
+        if self.scheduler is not None and self.reservation is None:
+            acquire = self.scheduler.acquire if wait else self.scheduler.try_acquire
+            self.reservation = acquire(self.smp, parse_size(self.memory) + self.accel_memory)
+        return self.scheduler is None or self.reservation is not None
+
+    def release(self):
+        try:
+            for p in self.procs:
+                if p.isalive():
+                    self.read_blockstats(p)
+                    self.quit(p)
+                p.qmp.close()
+                if p.agent is not None:
+                    p.agent.close()
+                p.close()
+        finally:
+            # a leaked slot would hold up the later tests of the worker
+            self.procs = []
+            if self.reservation is not None:
+                self.scheduler.release(self.reservation)
+                self.reservation = None
+
+    def control_args(self):
+        qmp_path = self.tmp_path / f"qmp{len(self.procs)}.sock"
+        agent_path = self.tmp_path / f"agent{len(self.procs)}.sock"
+        # -no-shutdown keeps qemu around after poweroff for read_blockstats
+        args = [
+            '-qmp', f'unix:{qmp_path},server=on,wait=off',
+            '-no-shutdown',
+            '-device', 'virtio-serial',
+            '-chardev', f'socket,id=agent,path={agent_path},server=on,wait=off',
+            '-device', f'virtserialport,chardev=agent,name={agent.PORT_NAME}',
+        ]
+        return args, qmp_path, agent_path
+
+    def attach(self, p, qmp_path, agent_path):
+        p.delaybeforesend = None
+        try:
+            p.qmp = qmp.QMPClient(qmp_path, alive=p.isalive)
+        except OSError:
+            p.terminate(force=True)
+            raise
+        p.agent_path = agent_path
+        p.agent = None
+        self.procs.append(p)
+        p.phase('spawn')
+        return p
+
+    async def release_async(self):
+        # quit() waits on the loop, so from another thread
+        await asyncio.to_thread(self.release)
+
+    def spawn(self, args):
+        self.reserve()
+        self.timeline.mark('vm admission')
+        control, qmp_path, agent_path = self.control_args()
+        if self.console_loop is not None:
+            p = aconsole.SyncConsole(self.console_loop, self.prog, args + control,
+                                     timeline=self.timeline, fatal=self.fatal_patterns)
+        else:
+            p = console.Console(self.prog, args + control, timeline=self.timeline,
+                                fatal=self.fatal_patterns)
+        return self.attach(p, qmp_path, agent_path)
+
+    async def spawn_async(self, args):
+        # on the loop of console_loop, returns the aconsole.AsyncConsole
+        while not self.reserve(wait=False):
+            await asyncio.sleep(self.scheduler.poll)
+        self.timeline.mark('vm admission')
+        control, qmp_path, agent_path = self.control_args()
+        con = await aconsole.spawn(self.prog, args + control, self.timeline, self.fatal_patterns)
+        # release() and the qmp helpers use the blocking view from other threads
+        p = aconsole.SyncConsole.wrap(self.console_loop, con)
+        await asyncio.to_thread(self.attach, p, qmp_path, agent_path)
+        return con
+
+    def status(self, p):
+        return p.qmp.execute('query-status')['status']
+
+    def read_blockstats(self, p):
+        disks = {os.path.splitext(os.path.basename(img))[0] for img in self.images}
+        try:
+            devices = p.qmp.execute('query-blockstats')
+        except (OSError, EOFError, qmp.QMPError):
+            return None
+        stats = {d['device']: {k: d['stats'].get(k, 0) for k in BLOCKSTATS}
+                 for d in devices if d.get('device') in disks}
+        self.blockstats.append({'vm': self.procs.index(p), 'profile': self.disk_profile,
+                                'drives': stats})
+        return stats
+
+    def quit(self, p, timeout=5):
+        # hard stop, does not wait for the guest
+        try:
+            p.qmp.execute('quit')
+        except (OSError, EOFError, qmp.QMPError):
+            pass
+        try:
+            p.expect(pexpect.EOF, timeout=timeout, fatal=False)
+        except pexpect.TIMEOUT:
+            pass
+        if p.isalive():
+            p.terminate(force=True)
+
+    def timeout(self, default, phase=None):
+        if self.timeout_model is None:
+            return default
+        return self.timeout_model.budget(timeouts.host_key(self.arch, self.accel), default, phase)
+
+    def wait_shutdown(self, p, timeout=10, phase='poweroff'):
+        timeout = self.timeout(timeout, phase)
+        try:
+            event = p.qmp.wait_event(['SHUTDOWN', 'GUEST_PANICKED'], timeout)
+        except TimeoutError:
+            self.quit(p)
+            pytest.fail(f"guest did not power off within {timeout}s")
+        except EOFError:
+            # qemu went away without telling
+            event = {'event': 'SHUTDOWN'}
+        if event['event'] == 'GUEST_PANICKED':
+            self.quit(p)
+            pytest.fail("guest kernel panicked")
+        self.read_blockstats(p)
+        # -no-shutdown keeps qemu running after the guest is off
+        self.quit(p)
+        p.phase(phase)
+
+    async def wait_shutdown_async(self, con, timeout=10, phase='poweroff'):
+        # qmp blocks, so off the loop, with the blocking view of the console
+        p = aconsole.SyncConsole.wrap(self.console_loop, con)
+        await asyncio.to_thread(self.wait_shutdown, p, timeout, phase)
+
+    def powerdown(self, p, timeout=30, phase='powerdown'):
+        # ACPI power button, quit if the guest ignores it
+        p.qmp.execute('system_powerdown')
+        self.wait_shutdown(p, timeout, phase)
+
+    def start_agent(self, p, prompt, password=None, timeout=10):
+        # commands and their output as data instead of typed and scraped
+        p.agent = agent.GuestAgent(p.agent_path, alive=p.isalive)
+        p.send_file('/tmp/agent.sh', agent.SCRIPT)
+        p.expect(prompt)
+        command = 'sh /tmp/agent.sh </dev/null >/dev/null 2>&1 &'
+        if password is None:
+            p.sendline(command)
+        else:
+            p.sendline(f"doas sh -c '{command}'")
+            p.expect("doas.*password:")
+            p.waitnoecho()
+            p.sendline(password)
+        p.expect(prompt)
+        p.agent.check('true', timeout=self.timeout(timeout, 'agent'))
+        p.phase('agent')
+        return p.agent
+
+    def record_boot(self, p):
+        rec = bootprofile.attach(p)
+        self.boot_recorders.append(rec)
+        return rec
+
+    def login(self, p, alpine_conf_iso=None, timeout=30, prompt_timeout=2):
+        while True:
+            i = p.expect_exact(["boot:", "Press enter to boot the selected OS", "login:"],
+                               timeout=self.timeout(timeout, 'login prompt'))
+            if i == 2:
+                p.phase('login prompt')
+                break
+            p.phase('bootloader')
+            p.sendline()
+        p.sendline("root")
+
+        p.timeout = self.timeout(prompt_timeout)
+        p.expect("localhost:~#", phase='shell')
+
+        if alpine_conf_iso is not None:
+            p.sendline(
+                "mkdir -p /media/ALPINECONF && mount LABEL=ALPINECONF /media/ALPINECONF && cp -r /media/ALPINECONF/* / && echo OK")
+            p.expect("OK")
+            p.expect("localhost:~#", phase='alpine-conf')
+        return p
+
+    async def live_login_async(self, con, alpine_conf_iso=None, timeout=30, prompt_timeout=2):
+        # live_login() on an aconsole.AsyncConsole
+        while True:
+            i = await con.expect_exact(["boot:", "Press enter to boot the selected OS", "login:"],
+                                       timeout=self.timeout(timeout, 'login prompt'))
+            if i == 2:
+                con.phase('login prompt')
+                break
+            con.phase('bootloader')
+            await con.sendline()
+        await con.sendline("root")
+
+        con.timeout = self.timeout(prompt_timeout)
+        await con.expect("localhost:~#", phase='shell')
+
+        if self.injects_alpine_conf(alpine_conf_iso):
+            alpine_conf_iso = None
+        if alpine_conf_iso is not None:
+            await con.sendline(
+                "mkdir -p /media/ALPINECONF && mount LABEL=ALPINECONF /media/ALPINECONF && cp -r /media/ALPINECONF/* / && echo OK")
+            await con.expect("OK")
+            await con.expect("localhost:~#", phase='alpine-conf')
+        return con
+
+    def live_key(self, disktype, bootmode, alpine_conf_iso=None):
+        # a VM booted by the warm pool has to be the one boot_live would have started
+        return (self.boot['iso'], disktype, bootmode, len(self.images), self.formatted,
+                self.memory, self.smp, self.disk_profile, self.direct_kernel_boot,
+                alpine_conf_iso)
+
+    def adopt(self, warm):
+        for img in self.images:
+            os.unlink(img)
+        self.images = warm.vm.images
+        warm.vm.images = []
+        self.apk_cache_stage, warm.vm.apk_cache_stage = warm.vm.apk_cache_stage, None
+        p = warm.p
+        warm.vm.procs.remove(p)
+        # our reservation covers it
+        warm.vm.release()
+        self.procs.append(p)
+        self.timeline.mark('warm pool')
+        p.timeline = self.timeline
+        return p
+
+    def boot_live(self, disktype, bootmode, alpine_conf_iso=None):
+        warm = None
+        if self.warm_pool is not None:
+            warm = self.warm_pool.take(self.live_key(disktype, bootmode, alpine_conf_iso))
+        if warm is not None:
+            p = self.adopt(warm)
+        elif self.snapshots is not None and self.snapshots.enabled:
+            p = self.snapshots.restore(self, disktype, bootmode, alpine_conf_iso)
+        else:
+            p = self.live_login(self.spawn(self.live_args(disktype, bootmode, alpine_conf_iso)),
+                                alpine_conf_iso)
+        if self.apk_cache is not None:
+            self.mount_apk_cache(p)
+        return p
+
+@pytest.fixture(scope='session')
+def vm_scheduler(request):
+    memory = request.config.getoption("--vm-memory")
+    if memory is None:
+        memory = max(scheduler.host_memory() - parse_size('2G'), parse_size('1G'))
+    # shared by all test sessions of this user on the host
+    path = os.path.join(tempfile.gettempdir(), f"alpine-installer-testsuite-{os.getuid()}")
+    return scheduler.HostScheduler(path,
+                                   cpus=request.config.getoption("--vm-cpus"),
+                                   memory=parse_size(memory),
+                                   max_vms=request.config.getoption("--max-vms"))
+
+@pytest.fixture(scope='session')
+def fatal_patterns(request):
+    patterns = {}
+    if request.config.getoption("default_fatal_patterns"):
+        patterns.update(console.FATAL_PATTERNS)
+    for spec in request.config.getoption("--fatal-pattern"):
+        name, sep, regex = spec.partition('=')
+        patterns[name if sep else spec] = regex if sep else spec
+    return patterns
+
+@pytest.fixture(scope='session')
+def http_server():
+    # files for the VMs, at 10.0.2.2 in the guest
+    server = apkmirror.ApkMirror()
+    yield server
+    server.close()
+
+@pytest.fixture(scope='session')
+def apk_mirror(request, iso_file, http_server):
+    extra = request.config.getoption("--apk-repo")
+    if not request.config.getoption("--local-apk-mirror") and not extra:
+        return None
+    # one repository per iso on the shared server
+    name = os.path.splitext(os.path.basename(iso_file))[0]
+    http_server.server.repos[name] = isocache.extract_apks(iso_file,
+                                                           cache_dir(request.config, 'iso'))
+    names = [name]
+    if extra:
+        http_server.server.repos['extra'] = os.path.realpath(extra)
+        names.append('extra')
+    return apkmirror.Repositories(http_server, names)
+
+@pytest.fixture(scope='session')
+def alpine_conf_url(request, alpine_conf_iso, http_server):
+    # only a -kernel boot can be told where to get the apkovl from
+    if alpine_conf_iso is None or not request.config.getoption("--direct-kernel-boot"):
+        return None
+    apkovl = isocache.build_apkovl(alpine_conf_iso, cache_dir(request.config, 'alpine-conf'))
+    return http_server.add_file('alpine-conf.apkovl.tar.gz', apkovl)
+
+@pytest.fixture(scope='session')
+def shared_apk_cache(request):
+    path = request.config.getoption("--shared-apk-cache")
+    if not path:
+        return None
+    return apkcache.SharedApkCache(os.path.realpath(path),
+                                   parse_size(request.config.getoption("--apk-cache-size")))
+
+@pytest.fixture(scope='session')
+def console_loop(request):
+    if request.config.getoption("--console-driver") != 'asyncio':
+        yield None
+        return
+    loop = aconsole.EventLoopThread()
+    yield loop
+    loop.close()
+
+def disk_profile(request):
+    marker = request.node.get_closest_marker('disk_profile')
+    if marker is not None:
+        return marker.args[0]
+    return request.config.getoption("--disk-profile")
 
 @pytest.fixture
-def qemu(iso_file, tmp_path, numdisks, boot_files):
-    return QemuVM(iso_file, tmp_path, numdisks, boot_files)
+def installed(request, qemu, alpine_conf_iso, install_store, rootfs, disktype, diskmode,
+              bootmode, disklabel):
+    # qemu with copies of the disks of the install these parameters describe
+    reason = install.unsupported(qemu.arch, qemu.xen, disktype=disktype, bootmode=bootmode)
+    if reason:
+        pytest.skip(reason)
+    params = dict(rootfs=rootfs, disktype=disktype, diskmode=diskmode, bootmode=bootmode,
+                  disklabel=disklabel)
+    images = install_store.get(qemu, params,
+                               lambda: install.install(request, qemu, alpine_conf_iso, **params))
+    qemu.use_disks(images)
+    return qemu
 
+@pytest.fixture(scope='session')
+def warm_pool(request, tmp_path_factory, vm_snapshots):
+    size = request.config.getoption("--warm-pool")
+    # xdist workers only learn their next test, snapshots already skip the boot
+    if not size or hasattr(request.config, 'workerinput') or vm_snapshots.enabled:
+        yield None
+        return
+    pool = warmpool.WarmPool(request.session, tmp_path_factory.mktemp('warm-pool'), size)
+    request.config.pluginmanager.register(pool, 'installer-warm-pool')
+    yield pool
+    pool.close()
+
+@pytest.fixture
+def make_vm(request, iso_file, boot_files, disk_images, vm_snapshots, vm_scheduler,
+            console_loop, fatal_patterns, apk_mirror, shared_apk_cache, alpine_conf_url):
+    def make(path, numdisks):
+        return QemuVM(iso_file, path, numdisks, boot_files, disk_images, vm_snapshots,
+                      request.config.getoption("--direct-kernel-boot"), vm_scheduler,
+                      console_loop, fatal_patterns,
+                      request.config.pluginmanager.get_plugin('installer-timeouts'),
+                      apk_mirror, shared_apk_cache, alpine_conf_url, disk_profile(request),
+                      request.config.getoption("--accel"))
+    return make
+
+def finish_vm(vm):
+    vm.release()
+    vm.remove_disks()
+    vm.save_apk_cache()
+    vm.timeout_model.observe(timeouts.host_key(vm.arch, vm.accel), vm.timeline.phases)
+
+@pytest.fixture
+def qemu_factory(tmp_path, make_vm):
+    # for a test that runs several VMs at once on the console_loop
+    vms = []
+    def make(numdisks):
+        path = tmp_path / f"vm{len(vms)}"
+        path.mkdir()
+        vms.append(make_vm(path, numdisks))
+        return vms[-1]
+    yield make
+    for vm in vms:
+        finish_vm(vm)
+
+@pytest.fixture
+def qemu(request, tmp_path, numdisks, make_vm, alpine_conf_iso, warm_pool):
+    vm = make_vm(tmp_path, numdisks)
+    if warm_pool is not None:
+        # reserve first, the pool only boots ahead with what is left
+        vm.reserve()
+        vm.warm_pool = warm_pool
+        warm_pool.prefetch(request.node, make_vm, vm.arch, vm.xen, alpine_conf_iso)
+    yield vm
+    finish_vm(vm)
+    request.node.user_properties.extend([
+        ('vm', timeouts.host_key(vm.arch, vm.accel)),
+        ('phases', vm.timeline.phases),
+        ('total', vm.timeline.total()),
+        ('started', vm.timeline.start),
+        ('boot_profiles', [rec.profile() for rec in vm.boot_recorders]),
+        ('blockstats', vm.blockstats),
+    ])
@@ -0,0 +1,100 @@
+import contextlib
+import re
+import time
+
+import pexpect
+
+# console output after which waiting for anything else is pointless
+FATAL_PATTERNS = {
+    'kernel panic': r'Kernel panic - not syncing[^\r\n]*',
+    'network boot': r'Start PXE[^\r\n]*',
+    'no bootable device': r'No bootable device[^\r\n]*',
+    'emergency shell': r'initramfs emergency recovery shell launched[^\r\n]*',
+    'out of memory': r'Out of memory: Kill[^\r\n]*',
+    'apk error': r'ERROR: (?:unable to select packages|unsatisfiable constraints)[^\r\n]*',
+}
+
+
+def compile_fatal(patterns):
+    return [(name, re.compile(pattern.encode(), re.DOTALL)) for name, pattern in patterns.items()]
+
+
+class GuestFailure(Exception):
+    def __init__(self, reason, output):
+        super().__init__(f"{reason}: {output}")
+        self.reason = reason
+        self.output = output
+
+
+class Timeline:
+    def __init__(self):
+        self.start = time.time()
+        self.last = time.monotonic()
+        self.t0 = self.last
+        self.prefix = ''
+        self.phases = []
+
+    def mark(self, name):
+        # a phase lasts from the previous mark until now
+        now = time.monotonic()
+        self.phases.append({'name': self.prefix + name,
+                            'start': round(self.last - self.t0, 3),
+                            'duration': round(now - self.last, 3)})
+        self.last = now
+
+    @contextlib.contextmanager
+    def section(self, prefix):
+        old = self.prefix
+        self.prefix = prefix + ': '
+        try:
+            yield
+        finally:
+            self.prefix = old
+
+    def total(self):
+        return round(self.last - self.t0, 3)
+
+
+class Console(pexpect.spawn):
+    def __init__(self, command, args=[], timeline=None, fatal=None, **kwargs):
+        super().__init__(command, args, **kwargs)
+        self.timeline = Timeline() if timeline is None else timeline
+        self.fatal = compile_fatal(FATAL_PATTERNS if fatal is None else fatal)
+
+    def phase(self, name):
+        self.timeline.mark(name)
+
+    def send_file(self, path, content, delimiter='__EOF__'):
+        # one round trip instead of one per line
+        self.send(f"cat > {path} <<'{delimiter}'\n{content}{delimiter}\n")
+
+    def expect(self, pattern, timeout=-1, searchwindowsize=-1, async_=False, phase=None,
+               fatal=True, **kw):
+        i = self.expect_list(self.compile_pattern_list(pattern), timeout, searchwindowsize,
+                             async_, fatal=fatal, **kw)
+        if phase is not None:
+            self.phase(phase)
+        return i
+
+    def expect_exact(self, pattern_list, timeout=-1, searchwindowsize=-1, async_=False,
+                     phase=None, fatal=True, **kw):
+        # as regexes, so the fatal patterns can be matched alongside
+        if not isinstance(pattern_list, list):
+            pattern_list = [pattern_list]
+        pattern_list = [p if p in (pexpect.EOF, pexpect.TIMEOUT) else re.escape(p)
+                        for p in pattern_list]
+        return self.expect(pattern_list, timeout, searchwindowsize, async_, phase=phase,
+                           fatal=fatal, **kw)
+
+    def expect_list(self, pattern_list, timeout=-1, searchwindowsize=-1, async_=False,
+                    fatal=True, **kw):
+        # fatal=False for waits that outlive the guest, like for EOF after quit,
+        # a panic seen before would match again in what is left of the output
+        fatal = self.fatal if fatal else []
+        # the callers patterns come first and win if they match at the same place
+        i = super().expect_list(list(pattern_list) + [regex for _, regex in fatal],
+                                timeout, searchwindowsize, async_, **kw)
+        if i >= len(pattern_list):
+            raise GuestFailure(self.fatal[i - len(pattern_list)][0],
+                               self.after.decode(errors='replace').strip())
+        return i
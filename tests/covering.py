@@ -0,0 +1,94 @@
+import itertools
+
+import pytest
+
+
+def covering_array(dimensions, strength=2, allowed=None):
+    # greedy: keep taking the combination that covers most uncovered t-tuples
+    names = list(dimensions)
+    rows = [dict(zip(names, values)) for values in itertools.product(*dimensions.values())]
+    if allowed is not None:
+        rows = [row for row in rows if allowed(row)]
+    strength = min(strength, len(names))
+
+    def tuples(row):
+        return {tuple((name, row[name]) for name in combo)
+                for combo in itertools.combinations(names, strength)}
+
+    covers = [tuples(row) for row in rows]
+    # t-tuples no allowed combination has are not wanted
+    uncovered = set().union(*covers)
+    chosen = []
+    while uncovered:
+        best = max(range(len(rows)), key=lambda i: len(covers[i] & uncovered))
+        chosen.append(rows[best])
+        uncovered -= covers[best]
+    return chosen
+
+
+class CoveringSelection:
+    def __init__(self, config, vm_arch):
+        self.config = config
+        # the constraints need the VM arch before any VM runs
+        self.vm_arch = vm_arch
+        self.mode = config.getoption("--combinations")
+        self.strength = config.getoption("--covering-strength")
+        self.selected = None
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, session, config, items):
+        if self.mode == 'full':
+            return
+        groups = {}
+        for item in items:
+            if getattr(item, 'callspec', None) is not None:
+                # each iso gets its own array, the constraints depend on its arch
+                iso = item.callspec.params.get('iso_file')
+                # tests of modules declaring the same covering_dimensions share one
+                # array, a test narrowing some of them down gets the rows that match
+                shared = getattr(item.module, 'covering_dimensions', None)
+                test = id(shared) if shared is not None else (item.module.__name__,
+                                                               item.originalname)
+                groups.setdefault((test, iso), []).append(item)
+
+        keep = set()
+        for (_, iso), group in groups.items():
+            arch, xen = self.vm_arch(config, iso)
+            dimensions = getattr(group[0].module, 'covering_dimensions', None)
+            if dimensions is None:
+                dimensions = {}
+                for item in group:
+                    for name, value in item.callspec.params.items():
+                        if name == 'iso_file':
+                            continue
+                        values = dimensions.setdefault(name, [])
+                        if value not in values:
+                            values.append(value)
+            unsupported = getattr(group[0].module, 'unsupported', None)
+
+            def allowed(row):
+                return unsupported is None or not unsupported(arch, xen, **row)
+
+            rows = covering_array(dimensions, self.strength, allowed)
+            for item in group:
+                params = {k: v for k, v in item.callspec.params.items() if k != 'iso_file'}
+                if params in rows:
+                    keep.add(item.nodeid)
+
+        selected = [item for item in items
+                    if getattr(item, 'callspec', None) is None or item.nodeid in keep]
+        deselected = [item for item in items if item not in selected]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+        self.selected = (len(selected), len(selected) + len(deselected))
+
+    def pytest_report_header(self, config):
+        if self.mode != 'full':
+            return f"combinations: {self.strength}-wise covering array"
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.selected is None or hasattr(self.config, 'workerinput'):
+            return
+        terminalreporter.write_line(
+            f"covering array: selected {self.selected[0]} of {self.selected[1]} test cases")
@@ -0,0 +1,223 @@
+import functools
+import re
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern, exact=False):
+    if exact:
+        pattern = re.escape(pattern)
+    # same flags pexpect uses for string patterns
+    return re.compile(pattern.encode(), re.DOTALL)
+
+
+class Prompt:
+    def __init__(self, name, pattern, answer='', optional=False, repeat=False,
+                 secret=False, timeout=None, exact=False):
+        self.name = name
+        self.regex = compile_pattern(pattern, exact)
+        # a string, None to not answer, or a callable that gets the dialog
+        self.answer = answer
+        self.optional = optional
+        self.repeat = repeat
+        self.secret = secret
+        self.timeout = timeout
+
+
+class Dialog:
+    def __init__(self, prompts):
+        assert prompts and not prompts[-1].optional
+        self.prompts = prompts
+        self.matches = {}
+        self.windows = {}
+
+    def window(self, pos):
+        # optional prompts up to and including the next required one
+        end = pos
+        while self.prompts[end].optional:
+            end += 1
+        return list(range(pos, end + 1))
+
+    def answer(self, prompt):
+        return prompt.answer(self) if callable(prompt.answer) else prompt.answer
+
+    def respond(self, p, prompt):
+        answer = self.answer(prompt)
+        if answer is None:
+            return
+        if prompt.secret:
+            p.waitnoecho()
+        p.sendline(answer)
+
+    def expecting(self, p, pos, budget):
+        # the prompts that may come next, their patterns and the longest timeout
+        if pos not in self.windows:
+            window = self.window(pos)
+            compiled = p.compile_pattern_list([self.prompts[i].regex for i in window])
+            self.windows[pos] = (window, compiled)
+        window, compiled = self.windows[pos]
+        timeouts = [self.prompts[i].timeout if budget is None
+                    else budget(self.prompts[i].timeout, self.prompts[i].name)
+                    for i in window if self.prompts[i].timeout is not None]
+        return window, compiled, max(timeouts, default=-1)
+
+    def matched(self, p, i):
+        prompt = self.prompts[i]
+        self.matches[prompt.name] = p.match
+        p.phase(prompt.name)
+        return prompt
+
+    def run(self, p, budget=None):
+        # budget(default, phase) may adjust the prompt timeouts
+        pos = 0
+        while pos < len(self.prompts):
+            window, compiled, timeout = self.expecting(p, pos, budget)
+            i = window[p.expect_list(compiled, timeout)]
+            prompt = self.matched(p, i)
+            self.respond(p, prompt)
+            pos = i if prompt.repeat else i + 1
+        return self.matches
+
+    async def run_async(self, con, budget=None):
+        # the same on an aconsole.AsyncConsole
+        pos = 0
+        while pos < len(self.prompts):
+            window, compiled, timeout = self.expecting(con, pos, budget)
+            i = window[await con.expect_list(compiled, timeout)]
+            prompt = self.matched(con, i)
+            answer = self.answer(prompt)
+            if answer is not None:
+                if prompt.secret:
+                    await con.waitnoecho()
+                await con.sendline(answer)
+            pos = i if prompt.repeat else i + 1
+        return self.matches
+
+
+def crypt_prompts(password, retry=True):
+    prompts = [Prompt('passphrase', "Enter passphrase for .*:", password, secret=True, timeout=20)]
+    if retry:
+        # a mismatching verification has to ask again
+        prompts.extend([
+            Prompt('verify wrong passphrase', "Verify passphrase:", 'WRONGPASSWORD', secret=True),
+            Prompt('passphrase again', "Enter passphrase for .*:", password, secret=True,
+                   timeout=5),
+        ])
+    prompts.extend([
+        Prompt('verify passphrase', "Verify passphrase:", password, secret=True, timeout=5),
+        Prompt('unlock notice', "Enter password again to unlock disk for installation.",
+               None, exact=True, timeout=60),
+        Prompt('unlock passphrase', "Enter passphrase for .*:", password, secret=True),
+    ])
+    return prompts
+
+
+def done_prompt(hostname, timeout=None):
+    return Prompt('setup-alpine complete', f"{hostname}:~#", None, timeout=timeout)
+
+
+def setup_alpine(hostname='alpine', password='testpassword', user=None, disks='none',
+                 diskmode=None, apkovl='.*', timeout=None, mirror=None):
+    prompts = [
+        Prompt('keyboard', "Select keyboard layout: [none] ", 'none', optional=True, exact=True),
+        Prompt('hostname', "Enter system hostname", hostname),
+        Prompt('interfaces', "Which one do you want to initialize\\?.*\\[eth0\\] "),
+        Prompt('bridge', "Do you want to bridge the interface eth0\\?.*\\[.*\\] ", 'no',
+               optional=True),
+        Prompt('ip address', "Ip address for eth0\\?.*\\[.*\\] ", 'dhcp', timeout=30),
+        Prompt('manual network',
+               "Do you want to do any manual network configuration\\? \\(y/n\\) \\[n\\] ",
+               timeout=10),
+        Prompt('root password', "New password: ", password, secret=True, timeout=20),
+        Prompt('retype root password', "Retype password: ", password, secret=True),
+        Prompt('timezone', "Which timezone.*\\[UTC\\] "),
+        Prompt('proxy', "HTTP/FTP proxy URL\\?.* \\[none\\] ", timeout=10),
+        Prompt('ntp', r'Which NTP client to run\? \(.*\) \[.*\] ', optional=True, timeout=30),
+        Prompt('more', r'--More--', 'q', optional=True, repeat=True, timeout=30),
+        Prompt('mirror', r'Enter mirror number.*or URL.* \[1\] ', mirror or '', timeout=30),
+    ]
+
+    if user is None:
+        prompts.append(Prompt('user', "Setup a user", 'no'))
+    else:
+        prompts.extend([
+            Prompt('user', "Setup a user", user),
+            Prompt('full name', f"Full name for user {user}"),
+            Prompt('user password', "New password", password, secret=True),
+            Prompt('retype user password', "Retype password", password, secret=True),
+            Prompt('ssh key', f"Enter ssh key or URL for {user}", 'none'),
+        ])
+
+    prompts.extend([
+        Prompt('ssh server', "Which ssh server\\? \\(.*\\) \\[openssh\\] ", 'none', timeout=20),
+        Prompt('root ssh login', "Allow root ssh login\\? \\(.*\\) \\[.*\\] ", optional=True),
+    ])
+
+    if diskmode is None:
+        prompts.extend([
+            Prompt('disks', "Which disk\\(s\\) would you like to use\\? \\(.*\\) \\[none\\] ", disks),
+            Prompt('apkovl', f"Enter where to store configs \\(.*\\) \\[{apkovl}\\] "),
+            Prompt('apk cache', "Enter apk cache directory \\(.*\\) \\[.*\\] "),
+            done_prompt(hostname, timeout),
+        ])
+        return Dialog(prompts)
+
+    prompts.extend([
+        Prompt('available disks',
+               "Available disks are.*?(sda|sdb|vda|vdb|nvme0n1|nvme1n1)", None, timeout=10),
+        Prompt('disks', "Which disk\\(s\\) would you like to use\\? \\(.*\\) \\[none\\] ", disks),
+        Prompt('diskmode', "How would you like to use (it|them)\\? \\(.*\\) \\[.*\\] ", diskmode),
+    ])
+    if diskmode == 'crypt':
+        prompts.append(Prompt('crypt diskmode',
+                              "How would you like to use (it|them)\\? \\(.*\\) \\[.*\\] ", 'sys'))
+    prompts.append(Prompt('erase disks',
+                          "WARNING: Erase the above disk\\(s\\) and continue\\? \\(y/n\\) \\[n\\] ",
+                          'y', timeout=10))
+    if diskmode in ('crypt', 'cryptsys'):
+        prompts.extend(crypt_prompts(password))
+    prompts.append(done_prompt(hostname, timeout))
+    return Dialog(prompts)
+
+
+def answer_file(hostname='alpine', user=None, disks=None, diskmode=None, mirror=None):
+    opts = [
+        ('KEYMAPOPTS', 'none'),
+        ('HOSTNAMEOPTS', hostname),
+        ('INTERFACESOPTS', 'auto lo\niface lo inet loopback\n\nauto eth0\niface eth0 inet dhcp\n'),
+        ('TIMEZONEOPTS', '-z UTC'),
+        ('PROXYOPTS', 'none'),
+        ('APKREPOSOPTS', mirror or '-1'),
+        ('USEROPTS', f'-a -u -g audio,video,netdev {user}' if user else 'none'),
+        ('SSHDOPTS', 'none'),
+        ('NTPOPTS', 'busybox'),
+    ]
+    if diskmode is None:
+        opts.extend([('DISKOPTS', 'none'), ('LBUOPTS', 'none'), ('APKCACHEOPTS', 'none')])
+    else:
+        modeopts = {'sys': '-m sys', 'lvmsys': '-m sys -L', 'cryptsys': '-m sys -e',
+                    'crypt': '-m sys -e'}
+        devices = ' '.join('/dev/'+d for d in disks.split())
+        opts.append(('DISKOPTS', f'{modeopts[diskmode]} {devices}'))
+    return ''.join(f'{k}="{v}"\n' for k, v in opts)
+
+
+def answer_file_setup(hostname='alpine', password='testpassword', user=None, diskmode=None,
+                      timeout=None):
+    # what setup-alpine -f still asks for interactively
+    prompts = [
+        Prompt('root password', "New password: ", password, secret=True, timeout=30),
+        Prompt('retype root password', "Retype password: ", password, secret=True),
+    ]
+    if user is not None:
+        prompts.extend([
+            Prompt('full name', f"Full name for user {user}", optional=True),
+            Prompt('user password', "New password", password, secret=True, optional=True,
+                   timeout=20),
+            Prompt('retype user password', "Retype password", password, secret=True,
+                   optional=True),
+            Prompt('ssh key', f"Enter ssh key or URL for {user}", 'none', optional=True),
+        ])
+    if diskmode in ('crypt', 'cryptsys'):
+        prompts.extend(crypt_prompts(password, retry=False))
+    prompts.append(done_prompt(hostname, timeout))
+    return Dialog(prompts)
@@ -0,0 +1,462 @@
+import os
+import re
+import struct
+
+SECTOR = 512
+
+
+class InspectError(Exception):
+    pass
+
+
+class RawImage:
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+
+    def read(self, offset, size):
+        self.f.seek(offset)
+        data = self.f.read(size)
+        # sparse tail
+        return data + bytes(size - len(data))
+
+    def close(self):
+        self.f.close()
+
+
+class Qcow2Image:
+    # enough of qcow2 to read what qemu-img create and a guest write
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        header = self.f.read(104)
+        (magic, version, backing_offset, backing_size, self.cluster_bits, self.size,
+         crypt, l1_size, l1_offset) = struct.unpack('>4sIQIIQIIQ', header[:48])
+        if magic != b'QFI\xfb':
+            raise InspectError(f"{path}: not a qcow2 image")
+        if crypt:
+            raise InspectError(f"{path}: encrypted qcow2")
+        if version >= 3 and struct.unpack('>Q', header[72:80])[0] & ~0x1:
+            # compression type, external data file, extended l2 entries
+            raise InspectError(f"{path}: unsupported qcow2 features")
+        self.cluster_size = 1 << self.cluster_bits
+        self.l2_entries = self.cluster_size // 8
+        self.f.seek(l1_offset)
+        self.l1 = struct.unpack(f'>{l1_size}Q', self.f.read(l1_size * 8))
+        self.l2_cache = {}
+        self.backing = None
+        if backing_offset:
+            self.f.seek(backing_offset)
+            backing = self.f.read(backing_size).decode()
+            self.backing = open_image(os.path.join(os.path.dirname(path), backing))
+
+    def l2(self, offset):
+        if offset not in self.l2_cache:
+            self.f.seek(offset)
+            self.l2_cache[offset] = struct.unpack(f'>{self.l2_entries}Q',
+                                                  self.f.read(self.cluster_size))
+        return self.l2_cache[offset]
+
+    def read_cluster(self, cluster, start, size):
+        l1_index, l2_index = divmod(cluster, self.l2_entries)
+        l2_offset = self.l1[l1_index] & 0x00fffffffffffe00 if l1_index < len(self.l1) else 0
+        entry = self.l2(l2_offset)[l2_index] if l2_offset else 0
+        if entry & (1 << 62):
+            raise InspectError(f"{self.path}: compressed clusters are not supported")
+        host = entry & 0x00fffffffffffe00
+        if entry & 1 or (not host and self.backing is None):
+            return bytes(size)
+        if not host:
+            return self.backing.read(cluster * self.cluster_size + start, size)
+        self.f.seek(host + start)
+        return self.f.read(size)
+
+    def read(self, offset, size):
+        data = []
+        while size > 0:
+            cluster, start = divmod(offset, self.cluster_size)
+            n = min(size, self.cluster_size - start)
+            data.append(self.read_cluster(cluster, start, n))
+            offset += n
+            size -= n
+        return b''.join(data)
+
+    def close(self):
+        self.f.close()
+        if self.backing is not None:
+            self.backing.close()
+
+
+def open_image(path):
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    return Qcow2Image(path) if magic == b'QFI\xfb' else RawImage(path)
+
+
+class Volume:
+    # a byte range of an image: a whole disk, a partition, md data or a logical volume
+    def __init__(self, image, offset, size, name):
+        self.image = image
+        self.offset = offset
+        self.size = size
+        self.name = name
+        self.fstype = None
+        self.label = None
+
+    def read(self, offset, size):
+        return self.image.read(self.offset + offset, size)
+
+    def __repr__(self):
+        return f"<Volume {self.name} {self.fstype} {self.size}>"
+
+
+def u16(data, offset):
+    return struct.unpack_from('<H', data, offset)[0]
+
+
+def u32(data, offset):
+    return struct.unpack_from('<I', data, offset)[0]
+
+
+def u64(data, offset):
+    return struct.unpack_from('<Q', data, offset)[0]
+
+
+MD_MAGIC = 0xa92b4efc
+
+
+def md_superblock(vol):
+    # 1.1 at the start, 1.2 4k in, 1.0 at the end
+    for offset in (0, 4096, ((vol.size // SECTOR - 16) & ~7) * SECTOR):
+        sb = vol.read(offset, 256)
+        if u32(sb, 0) == MD_MAGIC and u32(sb, 4) == 1:
+            return offset, sb
+    return None, None
+
+
+def identify(vol):
+    head = vol.read(0, 4096)
+    if head[:6] == b'LUKS\xba\xbe':
+        return 'crypto_LUKS', None
+    for sector in range(4):
+        s = head[sector * SECTOR:(sector + 1) * SECTOR]
+        if s[:8] == b'LABELONE' and s[24:32] == b'LVM2 001':
+            return 'LVM2_member', None
+    md_offset, _ = md_superblock(vol)
+    if md_offset is not None and md_offset < 8192:
+        return 'linux_raid_member', None
+    sb = vol.read(1024, 1024)
+    if u16(sb, 56) == 0xEF53:
+        label = sb[120:136].rstrip(b'\0').decode(errors='replace')
+        if u32(sb, 96) & 0x2c0:
+            # extents, 64bit or flex_bg
+            return 'ext4', label
+        return ('ext3' if u32(sb, 92) & 0x4 else 'ext2'), label
+    if head[:4] == b'XFSB':
+        return 'xfs', head[108:120].rstrip(b'\0').decode(errors='replace')
+    btrfs = vol.read(0x10000, 0x1000)
+    if btrfs[64:72] == b'_BHRfS_M':
+        return 'btrfs', btrfs[0x12b:0x12b + 256].rstrip(b'\0').decode(errors='replace')
+    if head[4086:4096] in (b'SWAPSPACE2', b'SWAP-SPACE'):
+        return 'swap', head[1052:1068].rstrip(b'\0').decode(errors='replace')
+    if head[510:512] == b'\x55\xaa':
+        if head[82:87] == b'FAT32':
+            return 'vfat', head[71:82].rstrip(b' \0').decode(errors='replace')
+        if head[54:59] in (b'FAT12', b'FAT16'):
+            return 'vfat', head[43:54].rstrip(b' \0').decode(errors='replace')
+        if head[512:520] == b'EFI PART':
+            return 'gpt', None
+        if any(head[446 + 16 * i + 4] for i in range(4)):
+            return 'dos', None
+    if md_offset is not None:
+        return 'linux_raid_member', None
+    return None, None
+
+
+def partitions(vol, table):
+    parts = []
+    if table == 'gpt':
+        header = vol.read(SECTOR, SECTOR)
+        entries_lba, count, entry_size = u64(header, 72), u32(header, 80), u32(header, 84)
+        data = vol.read(entries_lba * SECTOR, count * entry_size)
+        for i in range(count):
+            entry = data[i * entry_size:(i + 1) * entry_size]
+            if entry[:16] == bytes(16):
+                continue
+            first, last = u64(entry, 32), u64(entry, 40)
+            part = Volume(vol.image, vol.offset + first * SECTOR, (last - first + 1) * SECTOR,
+                          f"{vol.name}p{i + 1}")
+            part.partlabel = entry[56:128].decode('utf-16-le', errors='replace').rstrip('\0')
+            parts.append(part)
+    else:
+        mbr = vol.read(0, SECTOR)
+        for i in range(4):
+            entry = mbr[446 + 16 * i:446 + 16 * (i + 1)]
+            ptype, start, count = entry[4], u32(entry, 8), u32(entry, 12)
+            if ptype == 0 or ptype in (0x05, 0x0f, 0x85):
+                continue
+            part = Volume(vol.image, vol.offset + start * SECTOR, count * SECTOR,
+                          f"{vol.name}p{i + 1}")
+            part.parttype = ptype
+            parts.append(part)
+    return parts
+
+
+def md_data(vol):
+    offset, sb = md_superblock(vol)
+    data_offset, data_size = u64(sb, 128), u64(sb, 136)
+    if struct.unpack_from('<i', sb, 72)[0] != 1:
+        # each member of a mirror has all the data
+        raise InspectError(f"{vol.name}: only raid1 md members are supported")
+    return Volume(vol.image, vol.offset + data_offset * SECTOR, data_size * SECTOR,
+                  vol.name + '/md')
+
+
+def parse_lvm_metadata(text):
+    # the lvm2 text format: name = value, name { ... }
+    tokens = re.findall(r'"(?:[^"\\]|\\.)*"|[{}\[\]=,]|[^\s{}\[\]=,"#]+|#[^\n]*', text)
+    tokens = [t for t in tokens if not t.startswith('#')]
+    pos = 0
+
+    def value():
+        nonlocal pos
+        t = tokens[pos]
+        pos += 1
+        if t == '[':
+            items = []
+            while tokens[pos] != ']':
+                if tokens[pos] == ',':
+                    pos += 1
+                    continue
+                items.append(value())
+            pos += 1
+            return items
+        if t.startswith('"'):
+            return t[1:-1]
+        try:
+            return int(t)
+        except ValueError:
+            return t
+
+    def section():
+        nonlocal pos
+        result = {}
+        while pos < len(tokens) and tokens[pos] != '}':
+            name = tokens[pos]
+            if tokens[pos + 1] == '{':
+                pos += 2
+                result[name] = section()
+                pos += 1
+            elif tokens[pos + 1] == '=':
+                pos += 2
+                result[name] = value()
+            else:
+                pos += 1
+        return result
+
+    return section()
+
+
+def lvm_volumes(vol):
+    head = vol.read(0, 4 * SECTOR)
+    for sector in range(4):
+        label = head[sector * SECTOR:(sector + 1) * SECTOR]
+        if label[:8] == b'LABELONE':
+            break
+    pv = label[u32(label, 20):]
+    # pv uuid, device size, then lists of (offset, size) ending with zeros
+    pos = 40
+    areas = []
+    for _ in range(2):
+        locns = []
+        while u64(pv, pos):
+            locns.append((u64(pv, pos), u64(pv, pos + 8)))
+            pos += 16
+        pos += 16
+        areas.append(locns)
+    data_areas, metadata_areas = areas
+    mda_offset = metadata_areas[0][0]
+    mda = vol.read(mda_offset, SECTOR)
+    if mda[4:20] != b' LVM2 x[5A%r0N*>':
+        raise InspectError(f"{vol.name}: no lvm metadata")
+    text_offset, text_size = u64(mda, 40), u64(mda, 48)
+    text = vol.read(mda_offset + text_offset, text_size).rstrip(b'\0').decode()
+    meta = parse_lvm_metadata(text)
+    vgname, vg = next((k, v) for k, v in meta.items() if isinstance(v, dict))
+    extent = vg['extent_size'] * SECTOR
+    pe_start = data_areas[0][0]
+
+    lvs = []
+    for name, lv in vg.get('logical_volumes', {}).items():
+        segments = [v for k, v in lv.items() if k.startswith('segment')]
+        if len(segments) != 1 or segments[0].get('stripe_count') != 1:
+            raise InspectError(f"{vgname}/{name}: only linear volumes are supported")
+        seg = segments[0]
+        stripes = seg['stripes']
+        lvs.append(Volume(vol.image, vol.offset + pe_start + stripes[1] * extent,
+                          seg['extent_count'] * extent, f"{vol.name}/{vgname}-{name}"))
+    return lvs
+
+
+def walk(vol):
+    fstype, label = identify(vol)
+    if fstype in ('gpt', 'dos'):
+        return [v for part in partitions(vol, fstype) for v in walk(part)]
+    if fstype == 'linux_raid_member':
+        return walk(md_data(vol))
+    if fstype == 'LVM2_member':
+        return [v for lv in lvm_volumes(vol) for v in walk(lv)]
+    vol.fstype = fstype
+    vol.label = label
+    return [vol]
+
+
+class Ext4:
+    def __init__(self, vol):
+        self.vol = vol
+        sb = vol.read(1024, 1024)
+        if u16(sb, 56) != 0xEF53:
+            raise InspectError(f"{vol.name}: not an ext filesystem")
+        self.block_size = 1024 << u32(sb, 24)
+        self.inodes_per_group = u32(sb, 40)
+        self.first_data_block = u32(sb, 20)
+        self.inode_size = u16(sb, 88) if u32(sb, 76) >= 1 else 128
+        self.desc_size = u16(sb, 254) if u32(sb, 96) & 0x80 else 32
+
+    def block(self, n, count=1):
+        return self.vol.read(n * self.block_size, count * self.block_size)
+
+    def inode(self, n):
+        group, index = divmod(n - 1, self.inodes_per_group)
+        desc_offset = (self.first_data_block + 1) * self.block_size + group * self.desc_size
+        desc = self.vol.read(desc_offset, self.desc_size)
+        table = u32(desc, 8)
+        if self.desc_size >= 64:
+            table |= u32(desc, 0x28) << 32
+        return self.vol.read(table * self.block_size + index * self.inode_size, 160)
+
+    def extents(self, node):
+        magic, entries, _, depth = struct.unpack_from('<HHHH', node, 0)
+        if magic != 0xF30A:
+            raise InspectError(f"{self.vol.name}: bad extent header")
+        for i in range(entries):
+            e = node[12 + 12 * i:24 + 12 * i]
+            if depth == 0:
+                logical, length, hi, lo = struct.unpack('<IHHI', e)
+                # uninitialized extents read as zeros
+                yield logical, (hi << 32) | lo, length, length <= 32768
+            else:
+                _, lo, hi = struct.unpack('<IIH', e[:10])
+                yield from self.extents(self.block((hi << 32) | lo))
+
+    def read_inode(self, n):
+        inode = self.inode(n)
+        size = u32(inode, 4) | (u32(inode, 108) << 32)
+        flags = u32(inode, 32)
+        iblock = inode[40:100]
+        if flags & 0x10000000:
+            return iblock[:size]
+        data = bytearray(size)
+        if flags & 0x80000:
+            for logical, physical, length, initialized in self.extents(iblock):
+                length = length if initialized else length - 32768
+                start = logical * self.block_size
+                if start >= size or not initialized:
+                    continue
+                chunk = self.block(physical, length)[:size - start]
+                data[start:start + len(chunk)] = chunk
+        else:
+            for i, b in enumerate(struct.unpack('<12I', iblock[:48])):
+                start = i * self.block_size
+                if b and start < size:
+                    chunk = self.block(b)[:size - start]
+                    data[start:start + len(chunk)] = chunk
+        return bytes(data)
+
+    def mode(self, n):
+        return u16(self.inode(n), 0)
+
+    def entries(self, n):
+        data = self.read_inode(n)
+        pos = 0
+        while pos < len(data):
+            ino, rec_len, name_len = struct.unpack_from('<IHB', data, pos)
+            if rec_len < 8:
+                break
+            if ino:
+                yield data[pos + 8:pos + 8 + name_len].decode(errors='replace'), ino
+            pos += rec_len
+
+    def lookup(self, path):
+        ino = 2
+        for part in path.strip('/').split('/'):
+            if not part:
+                continue
+            if self.mode(ino) & 0xF000 != 0x4000:
+                raise NotADirectoryError(path)
+            found = dict(self.entries(ino)).get(part)
+            if found is None:
+                raise FileNotFoundError(path)
+            ino = found
+        return ino
+
+    def exists(self, path):
+        try:
+            self.lookup(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        return True
+
+    def isdir(self, path):
+        return self.exists(path) and self.mode(self.lookup(path)) & 0xF000 == 0x4000
+
+    def listdir(self, path):
+        return sorted(name for name, _ in self.entries(self.lookup(path))
+                      if name not in ('.', '..'))
+
+    def read(self, path):
+        return self.read_inode(self.lookup(path))
+
+
+class Disks:
+    def __init__(self, paths):
+        self.images = [open_image(str(p)) for p in paths]
+        self.volumes = []
+        for i, image in enumerate(self.images):
+            self.volumes.extend(walk(Volume(image, 0, image.size, f"disk{i}")))
+
+    def filesystems(self, *fstypes):
+        return [v for v in self.volumes if v.fstype in fstypes]
+
+    def root(self):
+        # setup-disk names it lv_root on lvm, else the largest one besides /boot
+        data = self.filesystems('ext2', 'ext3', 'ext4', 'xfs', 'btrfs')
+        for vol in data:
+            if vol.name.endswith('-lv_root'):
+                return vol
+        if len(data) > 1:
+            data = [v for v in data if v is not self.boot()]
+        if not data:
+            raise InspectError("no root filesystem found")
+        return max(data, key=lambda v: v.size)
+
+    def boot(self):
+        # the first filesystem on the first disk, / itself when there is no /boot
+        fs = [v for v in self.volumes if v.fstype not in (None, 'swap', 'crypto_LUKS')]
+        return min(fs, key=lambda v: (self.images.index(v.image), v.offset))
+
+    def open(self, vol):
+        if vol.fstype not in ('ext2', 'ext3', 'ext4'):
+            raise InspectError(f"{vol.name}: reading {vol.fstype} is not supported")
+        return Ext4(vol)
+
+    def close(self):
+        for image in self.images:
+            image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,96 @@
+import heapq
+import os
+import time
+
+import pytest
+
+CACHE_KEY = 'installer/durations'
+# weight of the latest run in the stored average
+ALPHA = 0.5
+
+
+def makespan(durations, workers):
+    # longest processing time first, each job to the least loaded worker
+    loads = [0.0] * max(workers, 1)
+    for d in durations:
+        heapq.heapreplace(loads, loads[0] + d)
+    return max(loads)
+
+
+def num_workers(config):
+    n = getattr(config.option, 'numprocesses', None)
+    if isinstance(n, int) and n > 0:
+        return n
+    if n:
+        return os.cpu_count()
+    return 1
+
+
+class DurationHistory:
+    def __init__(self, config):
+        self.config = config
+        self.enabled = config.getoption("duration_order")
+        self.history = {}
+        if getattr(config, 'cache', None) is not None:
+            self.history = config.cache.get(CACHE_KEY, {})
+        self.observed = {}
+        self.predicted = None
+        self.start = None
+
+    def expected(self, nodeid):
+        if nodeid in self.history:
+            return self.history[nodeid]
+        # unknown parametrization, guess from the other cases of the test
+        func = nodeid.split('[')[0]
+        same = [d for k, d in self.history.items() if k.split('[')[0] == func]
+        if same:
+            return sum(same) / len(same)
+        if self.history:
+            return sum(self.history.values()) / len(self.history)
+        return 0.0
+
+    def pytest_sessionstart(self, session):
+        self.start = time.monotonic()
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, session, config, items):
+        if not self.enabled or not self.history:
+            return
+        expected = {item.nodeid: self.expected(item.nodeid) for item in items}
+        items.sort(key=lambda item: expected[item.nodeid], reverse=True)
+        self.predicted = makespan([expected[item.nodeid] for item in items],
+                                  num_workers(config))
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_node_collection_finished(self, node, ids):
+        # the xdist controller does not collect, the workers report their
+        # collection in the order they sorted it
+        if not self.enabled or not self.history or self.predicted is not None:
+            return
+        self.predicted = makespan([self.expected(nodeid) for nodeid in ids],
+                                  num_workers(self.config))
+
+    def pytest_runtest_logreport(self, report):
+        if hasattr(self.config, 'workerinput'):
+            # the controller records the reports of all workers
+            return
+        self.observed[report.nodeid] = self.observed.get(report.nodeid, 0.0) + report.duration
+
+    def pytest_sessionfinish(self, session):
+        if hasattr(self.config, 'workerinput') or getattr(self.config, 'cache', None) is None:
+            return
+        history = self.config.cache.get(CACHE_KEY, {})
+        for nodeid, duration in self.observed.items():
+            if nodeid in history:
+                duration = ALPHA * duration + (1 - ALPHA) * history[nodeid]
+            history[nodeid] = round(duration, 3)
+        self.config.cache.set(CACHE_KEY, history)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.predicted is None or self.start is None or hasattr(self.config, 'workerinput'):
+            return
+        actual = time.monotonic() - self.start
+        terminalreporter.write_sep('-', 'duration ordering')
+        terminalreporter.write_line(
+            f"predicted makespan: {self.predicted:.0f}s, actual: {actual:.0f}s "
+            f"({num_workers(self.config)} worker(s))")
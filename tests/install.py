@@ -0,0 +1,231 @@
+import sys
+
+import pytest
+
+import dialog
+
+HOSTNAME = 'alpine'
+PASSWORD = 'testpassword'
+USER = 'juser'
+PROMPT = HOSTNAME+":~\\$"
+
+# what an install depends on, test_sys_install and the tests of the installed
+# system are parametrized with the same values so they share the installs
+PARAMS = {
+    'rootfs': ['ext4', 'xfs', 'btrfs'],
+    'bootmode': ['UEFI', 'bios'],
+    'diskmode': ['sys', 'lvmsys', 'cryptsys'],
+    'numdisks': [1, 2],
+    'disktype': ['virtio', 'ide', 'nvme'],
+    'disklabel': ['', 'gpt'],
+}
+
+
+def parametrize(**values):
+    # like stacked parametrize decorators in PARAMS order, values narrows some down
+    def decorate(func):
+        for name in reversed(list(PARAMS)):
+            func = pytest.mark.parametrize(name, values.get(name, PARAMS[name]))(func)
+        return func
+    return decorate
+
+
+def unsupported(arch, xen, disktype=None, bootmode=None, **params):
+    if bootmode == 'bios' and (arch == 'aarch64' or arch == 'arm'):
+        return "Only UEFI is supported on ARM"
+    if disktype == 'ide' and (arch == 'aarch64' or arch == 'arm'):
+        return "IDE is not supported on ARM"
+    if xen and disktype == 'virtio':
+        return "virtio not supported on Xen"
+
+
+def setup_mode(request, rootfs, disklabel):
+    mode = request.config.getoption("--setup-mode")
+    if mode != 'auto':
+        return mode
+    # the dialog itself only needs covering once per disk setup
+    return 'interactive' if rootfs == 'ext4' and disklabel == '' else 'answerfile'
+
+
+def install(request, qemu, alpine_conf_iso, rootfs, disktype, diskmode, bootmode, disklabel):
+    # boots the live iso, runs setup-alpine and powers off
+    mode = setup_mode(request, rootfs, disklabel)
+    p = qemu.boot_live(disktype, bootmode, alpine_conf_iso)
+
+#    p.logfile = sys.stdout.buffer
+
+    p.sendline("export KERNELOPTS='quiet console="+qemu.console+"'")
+    p.sendline("export ROOTFS="+rootfs)
+    if disklabel != "":
+        p.sendline("export DISKLABEL="+disklabel)
+
+    p.expect("localhost:~#")
+    d = {'ide': "sda sdb", 'virtio': "vda vdb", 'nvme': "nvme0n1 nvme1n1"}
+    if len(qemu.images) == 2:
+        disks = d[disktype]
+    elif mode == 'answerfile':
+        disks = d[disktype].split()[0]
+    else:
+        def disks(dlg):
+            return dlg.matches['available disks'].group(1).decode()
+
+    if mode == 'answerfile':
+        p.send_file('/tmp/answers', dialog.answer_file(HOSTNAME, user=USER, disks=disks,
+                                                       diskmode=diskmode,
+                                                       mirror=qemu.mirror_url))
+        p.expect("localhost:~#")
+        devices = ' '.join('/dev/'+d for d in disks.split())
+        p.sendline(f"ERASE_DISKS='{devices}' setup-alpine -f /tmp/answers")
+        dialog.answer_file_setup(HOSTNAME, PASSWORD, user=USER, diskmode=diskmode,
+                                 timeout=60).run(p, qemu.timeout)
+    else:
+        p.sendline("setup-alpine")
+        dialog.setup_alpine(HOSTNAME, PASSWORD, user=USER, disks=disks,
+                            diskmode=diskmode, timeout=60,
+                            mirror=qemu.mirror_url).run(p, qemu.timeout)
+
+    p.sendline("cat /proc/mdstat")
+    p.expect(HOSTNAME+":~#")
+    p.sendline("poweroff")
+    qemu.wait_shutdown(p, timeout=60, phase='poweroff')
+
+
+async def install_async(request, qemu, alpine_conf_iso, rootfs, disktype, diskmode, bootmode,
+                        disklabel):
+    # install() on the console_loop, for running several at once
+    mode = setup_mode(request, rootfs, disklabel)
+    con = await qemu.spawn_async(qemu.live_args(disktype, bootmode, alpine_conf_iso))
+    await qemu.live_login_async(con, alpine_conf_iso)
+
+    await con.sendline("export KERNELOPTS='quiet console="+qemu.console+"'")
+    await con.sendline("export ROOTFS="+rootfs)
+    if disklabel != "":
+        await con.sendline("export DISKLABEL="+disklabel)
+
+    await con.expect("localhost:~#")
+    d = {'ide': "sda sdb", 'virtio': "vda vdb", 'nvme': "nvme0n1 nvme1n1"}
+    if len(qemu.images) == 2:
+        disks = d[disktype]
+    elif mode == 'answerfile':
+        disks = d[disktype].split()[0]
+    else:
+        def disks(dlg):
+            return dlg.matches['available disks'].group(1).decode()
+
+    if mode == 'answerfile':
+        await con.send_file('/tmp/answers', dialog.answer_file(HOSTNAME, user=USER, disks=disks,
+                                                               diskmode=diskmode,
+                                                               mirror=qemu.mirror_url))
+        await con.expect("localhost:~#")
+        devices = ' '.join('/dev/'+d for d in disks.split())
+        await con.sendline(f"ERASE_DISKS='{devices}' setup-alpine -f /tmp/answers")
+        await dialog.answer_file_setup(HOSTNAME, PASSWORD, user=USER, diskmode=diskmode,
+                                       timeout=60).run_async(con, qemu.timeout)
+    else:
+        await con.sendline("setup-alpine")
+        await dialog.setup_alpine(HOSTNAME, PASSWORD, user=USER, disks=disks,
+                                  diskmode=diskmode, timeout=60,
+                                  mirror=qemu.mirror_url).run_async(con, qemu.timeout)
+
+    await con.sendline("cat /proc/mdstat")
+    await con.expect(HOSTNAME+":~#")
+    await con.sendline("poweroff")
+    await qemu.wait_shutdown_async(con, timeout=60, phase='poweroff')
+
+
+def boot_installed(qemu, disktype, bootmode, diskmode, phase='second boot'):
+    # boots the installed disks and logs in as the user
+    p = qemu.spawn(qemu.args(disktype, bootmode))
+    p.logfile = sys.stdout.buffer
+
+    if diskmode == "crypt" or diskmode == "cryptsys":
+        p.expect("Enter passphrase for .*:")
+        p.waitnoecho()
+        p.sendline(PASSWORD)
+
+    i = p.expect(["login:",
+                  "Start PXE",
+                  "No key available with this passphrase."],
+                 timeout=qemu.timeout(60, phase+' login'), phase=phase+' login')
+
+    if i == 1:
+        pytest.fail("Failed to boot from disk")
+
+    if i == 2:
+        pytest.fail("Failed to open encrypted disk")
+
+    p.sendline(USER)
+
+    p.expect("Password:", timeout=qemu.timeout(3))
+    p.waitnoecho()
+    p.sendline(PASSWORD)
+
+    p.expect(PROMPT, timeout=qemu.timeout(3, phase+' shell'), phase=phase+' shell')
+    return p
+
+
+async def boot_installed_async(qemu, disktype, bootmode, diskmode, phase='second boot'):
+    # boot_installed() on the console_loop
+    con = await qemu.spawn_async(qemu.args(disktype, bootmode))
+
+    if diskmode == "crypt" or diskmode == "cryptsys":
+        await con.expect("Enter passphrase for .*:")
+        await con.waitnoecho()
+        await con.sendline(PASSWORD)
+
+    i = await con.expect(["login:",
+                          "Start PXE",
+                          "No key available with this passphrase."],
+                         timeout=qemu.timeout(60, phase+' login'), phase=phase+' login')
+
+    if i == 1:
+        pytest.fail("Failed to boot from disk")
+
+    if i == 2:
+        pytest.fail("Failed to open encrypted disk")
+
+    await con.sendline(USER)
+
+    await con.expect("Password:", timeout=qemu.timeout(3))
+    await con.waitnoecho()
+    await con.sendline(PASSWORD)
+
+    await con.expect(PROMPT, timeout=qemu.timeout(3, phase+' shell'), phase=phase+' shell')
+    return con
+
+
+def run(qemu, p, cmds):
+    # the output of each command, as data through the agent where there is one
+    if qemu.agent_supported:
+        if p.agent is None:
+            qemu.start_agent(p, PROMPT, PASSWORD)
+        results = p.agent.run_many(cmds, timeout=qemu.timeout(10, 'checks'))
+        return [result.stdout for result in results]
+    outputs = []
+    for cmd in cmds:
+        # the echoed command line has no newline after the marker
+        p.sendline(f"echo __OUT__; {cmd}; echo __END__")
+        p.expect("__OUT__\r\n(.*?)__END__", timeout=qemu.timeout(10))
+        outputs.append(p.match.group(1).decode(errors='replace').replace('\r\n', '\n'))
+    p.phase('checks')
+    return outputs
+
+
+def poweroff(qemu, p, phase='second poweroff'):
+    if p.agent is not None:
+        # the reply may not make it before the shutdown
+        p.agent.send("poweroff")
+    else:
+        p.sendline("doas poweroff")
+        p.expect("doas.*password:")
+        p.waitnoecho()
+        p.sendline(PASSWORD)
+    qemu.wait_shutdown(p, timeout=20, phase=phase)
+
+
+async def poweroff_async(qemu, con, phase='second poweroff'):
+    await con.sendline("doas poweroff")
+    await con.expect("doas.*password:")
+    await con.waitnoecho()
+    await con.sendline(PASSWORD)
+    await qemu.wait_shutdown_async(con, timeout=20, phase=phase)
@@ -0,0 +1,220 @@
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+import libarchive
+
+
+def read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024*1024)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def iso_hash(path, cachedir):
+    # only hash the whole image when it changed since last time
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+    hashes_file = os.path.join(cachedir, 'hashes.json')
+    hashes = read_json(hashes_file, {})
+    known = hashes.get(path)
+    if known and known['stamp'] == stamp:
+        return known['sha256']
+
+    digest = file_hash(path)
+    hashes = read_json(hashes_file, {})
+    hashes[path] = {'stamp': stamp, 'sha256': digest}
+    write_json(hashes_file, hashes)
+    return digest
+
+
+def extract_entry(entry, dest):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with open(dest, 'wb') as f:
+        for block in entry.get_blocks():
+            f.write(block)
+
+
+def scan_iso(iso, outdir):
+    files = []
+    with libarchive.file_reader(iso) as a:
+        for entry in a:
+            path = entry.pathname
+            if path.startswith('./'):
+                path = path[2:]
+            if not entry.isfile:
+                continue
+            files.append(path)
+            if (path.startswith("boot/vmlinuz") or path.startswith("boot/initramfs")
+                    or path == '.alpine-release'):
+                dest = os.path.join(outdir, path)
+                extract_entry(entry, dest)
+                os.chmod(dest, 0o640)
+    return files
+
+
+def build_index(iso, files, extractdir, outdir):
+    # the files are read from extractdir, the paths in the index point to outdir
+    index = {'iso': os.path.basename(iso)}
+
+    release = os.path.join(extractdir, '.alpine-release')
+    if os.path.exists(release):
+        with open(release) as f:
+            index['release'] = f.read().strip()
+
+    arches = sorted({f.split('/')[1] for f in files
+                     if f.startswith('apks/') and f.endswith('/APKINDEX.tar.gz')})
+    if arches:
+        index['arch'] = arches[0]
+    else:
+        index['arch'] = os.path.splitext(os.path.basename(iso))[0].split('-')[-1]
+
+    kernels = {}
+    for f in sorted(files):
+        m = re.match(r'boot/vmlinuz-(.*)$', f)
+        if m and f'boot/initramfs-{m.group(1)}' in files:
+            kernels[m.group(1)] = {
+                'kernel': os.path.join(outdir, f),
+                'initrd': os.path.join(outdir, f'boot/initramfs-{m.group(1)}'),
+            }
+    index['kernels'] = kernels
+    index['xen'] = 'boot/xen.gz' in files
+    if index['xen']:
+        index['flavour'] = 'xen'
+    elif kernels:
+        index['flavour'] = sorted(kernels)[0]
+
+    apks = [os.path.basename(f)[:-4] for f in files
+            if f.startswith(f"apks/{index['arch']}/") and f.endswith('.apk')]
+    index['apks'] = sorted(apks)
+    for flavor in kernels:
+        for apk in apks:
+            m = re.match(rf'linux-{re.escape(flavor)}-(\d.*)$', apk)
+            if m:
+                kernels[flavor]['version'] = m.group(1)
+
+    bootloaders = []
+    if any(f.startswith('boot/syslinux/') for f in files):
+        bootloaders.append('syslinux')
+    if any(f.startswith('boot/grub/') for f in files):
+        bootloaders.append('grub')
+    if any(re.match(r'efi/boot/boot.*\.efi$', f, re.I) for f in files):
+        bootloaders.append('efi')
+    index['bootloaders'] = bootloaders
+    return index
+
+
+def load(iso, cachedir):
+    os.makedirs(cachedir, exist_ok=True)
+    digest = iso_hash(iso, cachedir)
+    outdir = os.path.join(cachedir, digest)
+    index = read_json(os.path.join(outdir, 'index.json'))
+    if index is not None:
+        return index
+
+    tmpdir = tempfile.mkdtemp(dir=cachedir, prefix='.tmp-')
+    try:
+        files = scan_iso(iso, tmpdir)
+        index = build_index(iso, files, tmpdir, outdir)
+        index['sha256'] = digest
+        write_json(os.path.join(tmpdir, 'index.json'), index)
+        try:
+            os.rename(tmpdir, outdir)
+        except OSError:
+            # extracted concurrently by someone else
+            shutil.rmtree(tmpdir)
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+    return read_json(os.path.join(outdir, 'index.json'))
+
+
+def extract_apks(iso, cachedir):
+    # the apks/ repository of the iso, for the local mirror
+    index = load(iso, cachedir)
+    outdir = os.path.join(cachedir, index['sha256'], 'apks')
+    if os.path.isdir(outdir):
+        return outdir
+
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(outdir), prefix='.tmp-')
+    try:
+        with libarchive.file_reader(iso) as a:
+            for entry in a:
+                path = entry.pathname
+                if path.startswith('./'):
+                    path = path[2:]
+                if entry.isfile and path.startswith('apks/'):
+                    extract_entry(entry, os.path.join(tmpdir, path[len('apks/'):]))
+        try:
+            os.rename(tmpdir, outdir)
+        except OSError:
+            shutil.rmtree(tmpdir)
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+    return outdir
+
+
+def build_apkovl(iso, cachedir):
+    # the files of an alpine-conf iso as apkovl, applied by the initramfs
+    os.makedirs(cachedir, exist_ok=True)
+    path = os.path.join(cachedir, iso_hash(iso, cachedir) + '.apkovl.tar.gz')
+    if os.path.exists(path):
+        return path
+
+    fd, tmp = tempfile.mkstemp(dir=cachedir, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f, tarfile.open(fileobj=f, mode='w:gz') as tar:
+            with libarchive.file_reader(iso) as a:
+                for entry in a:
+                    name = entry.pathname
+                    if name.startswith('./'):
+                        name = name[2:]
+                    if not name or not (entry.isfile or entry.isdir or entry.issym):
+                        continue
+                    info = tarfile.TarInfo(name)
+                    info.mode = entry.mode & 0o7777 or (0o755 if entry.isdir else 0o644)
+                    info.mtime = entry.mtime or 0
+                    if entry.isdir:
+                        info.type = tarfile.DIRTYPE
+                        tar.addfile(info)
+                    elif entry.issym:
+                        info.type = tarfile.SYMTYPE
+                        info.linkname = entry.linkpath
+                        tar.addfile(info)
+                    else:
+                        data = b''.join(entry.get_blocks())
+                        info.size = len(data)
+                        tar.addfile(info, io.BytesIO(data))
+            # without it the initramfs does not enable the default services
+            tar.addfile(tarfile.TarInfo('etc/.default_boot_services'))
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
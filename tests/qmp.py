@@ -0,0 +1,81 @@
+import json
+import socket
+import time
+
+
+class QMPError(Exception):
+    pass
+
+
+def connect(path, timeout=10, alive=None):
+    # qemu creates the socket some time after it started
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(path))
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if time.monotonic() > deadline or (alive is not None and not alive()):
+                raise
+            time.sleep(0.05)
+
+
+class QMPClient:
+    def __init__(self, path, timeout=10, alive=None):
+        self.sock = connect(path, timeout, alive)
+        self.sock.settimeout(timeout)
+        self.timeout = timeout
+        self.buf = b''
+        self.events = []
+        self.greeting = self.read()
+        self.execute('qmp_capabilities')
+
+    def read(self, deadline=None):
+        while b'\n' not in self.buf:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("no message from qemu")
+                self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                raise TimeoutError("no message from qemu")
+            finally:
+                self.sock.settimeout(self.timeout)
+            if not data:
+                raise EOFError("qmp connection closed")
+            self.buf += data
+        line, _, self.buf = self.buf.partition(b'\n')
+        return json.loads(line)
+
+    def execute(self, cmd, **arguments):
+        msg = {'execute': cmd}
+        if arguments:
+            msg['arguments'] = arguments
+        self.sock.sendall(json.dumps(msg).encode())
+        while True:
+            resp = self.read()
+            if 'event' in resp:
+                # keep them for wait_event
+                self.events.append(resp)
+            elif 'error' in resp:
+                raise QMPError(f"{cmd}: {resp['error']['desc']}")
+            elif 'return' in resp:
+                return resp['return']
+
+    def wait_event(self, names, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            for i, event in enumerate(self.events):
+                if event['event'] in names:
+                    return self.events.pop(i)
+            self.events = []
+            msg = self.read(deadline)
+            if 'event' in msg:
+                self.events.append(msg)
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+from isocache import file_hash
+
+CACHE_KEY = 'installer/results'
+
+
+class ResultCache:
+    def __init__(self, config, inputs):
+        self.config = config
+        # callable returning what all tests of the session depend on
+        self.inputs = inputs
+        self.reuse = config.getoption("--reuse-results")
+        self.max_age = config.getoption("--result-max-age") * 24 * 3600
+        self.results = {}
+        if getattr(config, 'cache', None) is not None:
+            self.results = config.cache.get(CACHE_KEY, {})
+        self.file_hashes = {}
+        self.passed = {}
+        self.failed = set()
+        self.reused = 0
+
+    def file_hash(self, path):
+        if path not in self.file_hashes:
+            self.file_hashes[path] = file_hash(path)
+        return self.file_hashes[path]
+
+    def harness_hash(self, testdir):
+        # conftest and the helper modules, the test modules count separately
+        h = hashlib.sha256()
+        for name in sorted(os.listdir(testdir)):
+            if name.endswith('.py') and not name.startswith('test_'):
+                h.update(name.encode() + self.file_hash(os.path.join(testdir, name)).encode())
+        return h.hexdigest()
+
+    def key(self, item, inputs):
+        path = str(item.fspath)
+        data = dict(inputs,
+                    harness=self.harness_hash(os.path.dirname(path)),
+                    test=self.file_hash(path),
+                    nodeid=item.nodeid)
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def fresh(self, key):
+        result = self.results.get(key)
+        return result is not None and time.time() - result['passed'] < self.max_age
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, session, config, items):
+        inputs = self.inputs(config)
+        if inputs is None:
+            return
+        for item in items:
+            key = self.key(item, inputs)
+            # the xdist controller learns the key from the reports
+            item.user_properties.append(('result_key', key))
+            if self.reuse and self.fresh(key):
+                item.add_marker(pytest.mark.skip(
+                    reason="passed before with the same iso, tests, qemu and firmware"))
+
+    def pytest_runtest_logreport(self, report):
+        if hasattr(self.config, 'workerinput'):
+            return
+        key = dict(report.user_properties).get('result_key')
+        if key is None:
+            return
+        if report.failed:
+            self.failed.add(key)
+        elif report.when == 'setup' and report.skipped and self.reuse and self.fresh(key):
+            self.reused += 1
+        elif report.when == 'call' and report.passed:
+            self.passed[key] = report.nodeid
+
+    def pytest_sessionfinish(self, session):
+        if hasattr(self.config, 'workerinput') or getattr(self.config, 'cache', None) is None:
+            return
+        results = self.config.cache.get(CACHE_KEY, {})
+        now = time.time()
+        for key, nodeid in self.passed.items():
+            if key not in self.failed:
+                results[key] = {'nodeid': nodeid, 'passed': now}
+        for key in self.failed:
+            results.pop(key, None)
+        results = {k: v for k, v in results.items() if now - v['passed'] < self.max_age}
+        self.config.cache.set(CACHE_KEY, results)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.reused and not hasattr(self.config, 'workerinput'):
+            terminalreporter.write_line(
+                f"result cache: skipped {self.reused} test(s) that passed before")
@@ -0,0 +1,110 @@
+import contextlib
+import fcntl
+import json
+import os
+import time
+
+# memory used by qemu itself on top of the guest RAM
+QEMU_OVERHEAD = 256*1024*1024
+
+
+@contextlib.contextmanager
+def locked(path):
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def host_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def host_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class HostScheduler:
+    def __init__(self, path, cpus=None, memory=None, max_vms=None, poll=0.5):
+        os.makedirs(path, exist_ok=True)
+        self.state_file = os.path.join(path, 'vms.json')
+        self.lock_file = os.path.join(path, 'vms.lock')
+        self.cpus = cpus or host_cpus()
+        self.memory = memory or host_memory()
+        self.max_vms = max_vms
+        self.poll = poll
+        self.count = 0
+
+    def read_state(self):
+        try:
+            with open(self.state_file) as f:
+                vms = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        # forget VMs of workers that died without releasing them
+        return {k: v for k, v in vms.items() if pid_alive(v['pid'])}
+
+    def write_state(self, vms):
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(vms, f)
+        os.replace(tmp, self.state_file)
+
+    def fits(self, vms, cpus, memory):
+        if not vms:
+            # always admit one VM, even if it asks for more than the host has
+            return True
+        if self.max_vms is not None and len(vms) >= self.max_vms:
+            return False
+        used_cpus = sum(v['cpus'] for v in vms.values())
+        used_memory = sum(v['memory'] for v in vms.values())
+        return (used_cpus + cpus <= self.cpus
+                and used_memory + memory <= self.memory)
+
+    def try_acquire(self, cpus, memory):
+        memory += QEMU_OVERHEAD
+        with locked(self.lock_file):
+            vms = self.read_state()
+            if not self.fits(vms, cpus, memory):
+                return None
+            self.count += 1
+            token = f"{os.getpid()}-{self.count}"
+            vms[token] = {'pid': os.getpid(), 'cpus': cpus, 'memory': memory,
+                          'since': time.time()}
+            self.write_state(vms)
+            return token
+
+    def acquire(self, cpus, memory):
+        while True:
+            token = self.try_acquire(cpus, memory)
+            if token is not None:
+                return token
+            time.sleep(self.poll)
+
+    def release(self, token):
+        with locked(self.lock_file):
+            vms = self.read_state()
+            vms.pop(token, None)
+            self.write_state(vms)
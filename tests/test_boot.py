@@ -1,55 +1,76 @@
 
-import os
-import pexpect
+import bootprofile
 import pytest
 import subprocess
 import sys
 
 
+def unsupported(arch, xen, disktype=None, bootmode=None, **params):
+    if (disktype == 'ide' or bootmode == 'bios') and (arch == 'aarch64' or arch == 'arm'):
+        return "not supported on this architecture"
+
+
 @pytest.mark.parametrize('bootmode', ['UEFI', 'bios'])
 @pytest.mark.parametrize('numdisks', [0])
 @pytest.mark.parametrize('disktype', ['virtio', 'ide', 'nvme', 'usb'])
 def test_boot(qemu, disktype, bootmode):
-    if (disktype == 'ide' or bootmode == 'bios') and (qemu.arch == 'aarch64' or qemu.arch == 'arm'):
-        pytest.skip("not supported on this architecture")
-
-    qemu_args = qemu.machine_args + [
-        '-nographic',
-        '-m', '512M',
-        '-smp', '4',
-    ]
-
-    img = qemu.boot['iso']
-    driveid = os.path.splitext(os.path.basename(img))[0]
-    if disktype == 'nvme':
-        qemu_args.extend([
-            '-drive', f'if=none,id={driveid},format=raw,file={img}',
-            '-device', f'nvme,serial={driveid},drive={driveid}'
-        ])
-    elif disktype == 'usb':
-        qemu_args.extend([
-            '-drive', f'if=none,id={driveid},format=raw,file={img}',
-            '-device', 'qemu-xhci',
-            '-device', f'usb-storage,drive={driveid}'
-        ])
-    else:
-        qemu_args.extend(
-            ['-drive', f'if={disktype},format=raw,file={img}'])
+    reason = unsupported(qemu.arch, qemu.xen, disktype=disktype, bootmode=bootmode)
+    if reason:
+        pytest.skip(reason)
+
+    qemu_args = qemu.args(disktype, bootmode, [qemu.boot['iso']], snapshot=True)
 
     if bootmode == 'UEFI':
-        qemu_args.extend([
-            '-drive', 'if=pflash,format=raw,readonly=on,file='+qemu.uefi_code,
-            '-boot', 'menu=on,splash-time=0'
-        ])
+        qemu_args.extend(['-boot', 'menu=on,splash-time=0'])
 
-    p = pexpect.spawn(qemu.prog, qemu_args)
+    p = qemu.spawn(qemu_args)
+    qemu.record_boot(p)
 
     p.logfile = sys.stdout.buffer
 
-    p.expect("login:", timeout=30)
+    p.expect("login:", timeout=qemu.timeout(30, 'login prompt'), phase='login prompt')
+    p.sendline("root")
+
+    p.timeout = qemu.timeout(2)
+    p.expect("localhost:~#")
+    p.sendline("poweroff")
+    qemu.wait_shutdown(p, timeout=10, phase='poweroff')
+
+
+def profile_boot(qemu, boot_files):
+    qemu.boot = boot_files
+    p = qemu.spawn(qemu.args('virtio', 'bios', []) + ['-cdrom', boot_files['iso']]
+                   + qemu.kernel_args('printk.time=1', quiet=False))
+    rec = qemu.record_boot(p)
+
+    p.expect("login:", timeout=qemu.timeout(60, 'login prompt'), phase='login prompt')
     p.sendline("root")
 
-    p.timeout = 2
+    p.timeout = qemu.timeout(5)
     p.expect("localhost:~#")
     p.sendline("poweroff")
-    p.expect(pexpect.EOF, timeout=10)
+    qemu.wait_shutdown(p, timeout=10, phase='poweroff')
+    return rec.profile()
+
+
+@pytest.mark.parametrize('numdisks', [0])
+def test_boot_profile(request, qemu, boot_files, baseline_boot_files):
+    if baseline_boot_files is None:
+        pytest.skip("no --baseline-iso to compare with")
+    if baseline_boot_files['index']['arch'] != qemu.iso_arch:
+        pytest.skip("--baseline-iso is for a different architecture")
+    if qemu.xen:
+        pytest.skip("Xen isos cannot be booted with -kernel")
+
+    runs = request.config.getoption("--boot-profile-runs")
+    threshold = request.config.getoption("--boot-regression-threshold")
+
+    profile = bootprofile.median_profile(
+        [profile_boot(qemu, boot_files) for i in range(runs)])
+    baseline = bootprofile.median_profile(
+        [profile_boot(qemu, baseline_boot_files) for i in range(runs)])
+
+    slower = bootprofile.regressions(profile, baseline, threshold)
+    if slower:
+        pytest.fail("boot got slower than with the baseline iso:\n" + "\n".join(
+            f"  {name}: {base:.2f}s -> {new:.2f}s" for name, base, new in slower))
@@ -0,0 +1,34 @@
+import covering
+import install
+import pytest
+
+# The rows of the test_sys_install covering array, installed at once from the
+# one event loop of --console-driver asyncio instead of one xdist worker per VM.
+# The host scheduler admits the VMs, the others wait for room on the loop.
+
+
+def test_concurrent_installs(request, console_loop, qemu_factory, alpine_conf_iso):
+    if console_loop is None:
+        pytest.skip("needs --console-driver asyncio")
+
+    # no disks, only to tell which rows the arch supports
+    probe = qemu_factory(0)
+
+    def allowed(row):
+        return not install.unsupported(probe.arch, probe.xen, **row)
+
+    rows = covering.covering_array(install.PARAMS,
+                                   request.config.getoption("--covering-strength"), allowed)
+
+    async def scenario(qemu, row):
+        params = {k: v for k, v in row.items() if k != 'numdisks'}
+        try:
+            await install.install_async(request, qemu, alpine_conf_iso, **params)
+            con = await install.boot_installed_async(qemu, row['disktype'], row['bootmode'],
+                                                     row['diskmode'])
+            await install.poweroff_async(qemu, con)
+        finally:
+            # room for the rows still waiting
+            await qemu.release_async()
+
+    console_loop.gather([scenario(qemu_factory(row['numdisks']), row) for row in rows])
@@ -0,0 +1,90 @@
+import diskinspect
+import install
+import pytest
+
+# the constraints of the covering array, and the dimensions of the one of
+# test_sys_install so these tests check the systems it installed
+from install import unsupported  # noqa: F401
+from install import PARAMS as covering_dimensions  # noqa: F401
+
+# Each test checks one thing of an installed system. They start from a copy of
+# the disks test_sys_install left behind, or install first if it has not run yet.
+# What can be read from the disk images is checked on the host without a boot.
+
+
+def guest(qemu, disktype, bootmode, diskmode, cmds):
+    p = install.boot_installed(qemu, disktype, bootmode, diskmode, phase='boot')
+    outputs = install.run(qemu, p, cmds)
+    install.poweroff(qemu, p, phase='poweroff')
+    return outputs
+
+
+@install.parametrize()
+def test_rootfs(installed, rootfs, disktype, bootmode, diskmode):
+    if diskmode != 'cryptsys':
+        with diskinspect.Disks(installed.images) as disks:
+            assert disks.root().fstype == rootfs
+        return
+    out, = guest(installed, disktype, bootmode, diskmode,
+                 ['awk \'$2 == "/" {print $3}\' /proc/mounts'])
+    assert out.split() == [rootfs]
+
+
+@install.parametrize()
+def test_boot_size(installed, disktype, bootmode, diskmode):
+    # /boot partition is at least 90MB
+    if diskmode != 'cryptsys':
+        with diskinspect.Disks(installed.images) as disks:
+            size = disks.boot().size // 1024
+    else:
+        out, = guest(installed, disktype, bootmode, diskmode,
+                     ['df -P -k /boot | awk \'$6 == "/boot" || $6 == "/" {print $2}\''])
+        size = int(out.split()[0])
+    if size < 90000:
+        pytest.fail(f"/boot is {size} kb, less than 90000 kb")
+
+
+@install.parametrize()
+def test_firmware(installed, rootfs, disktype, bootmode, diskmode):
+    if diskmode != 'cryptsys' and rootfs == 'ext4':
+        with diskinspect.Disks(installed.images) as disks:
+            world = disks.open(disks.root()).read('etc/apk/world').decode()
+    else:
+        world, = guest(installed, disktype, bootmode, diskmode, ["cat /etc/apk/world"])
+    assert 'linux-firmware-none' in world.split()
+
+
+@install.parametrize()
+def test_home(installed, rootfs, disktype, bootmode, diskmode):
+    if diskmode != 'cryptsys' and rootfs == 'ext4':
+        with diskinspect.Disks(installed.images) as disks:
+            assert disks.open(disks.root()).isdir('home/'+install.USER)
+        return
+    out, = guest(installed, disktype, bootmode, diskmode, ["cd ~"+install.USER+" && pwd"])
+    assert out.split() == ["/home/"+install.USER]
+
+
+@install.parametrize()
+def test_xen(request, qemu, rootfs, disktype, diskmode, bootmode, disklabel):
+    if not qemu.xen:
+        pytest.skip("not a Xen iso")
+    # only now, a skipped test should not install
+    installed = request.getfixturevalue('installed')
+    out, = guest(installed, disktype, bootmode, diskmode,
+                 ["test -e /proc/xen && echo OK || echo FAIL"])
+    if out.split() != ['OK']:
+        pytest.fail("/proc/xen expected to exist")
+
+
+@install.parametrize(diskmode=['cryptsys'])
+def test_crypt_unlock(installed, disktype, bootmode, diskmode):
+    # boot_installed enters the passphrase, the root has to be on the opened device
+    uuids, = guest(installed, disktype, bootmode, diskmode, ["cat /sys/block/dm-*/dm/uuid"])
+    assert any(uuid.startswith('CRYPT-') for uuid in uuids.split())
+
+
+@install.parametrize(numdisks=[2])
+def test_mdstat(installed, disktype, bootmode, diskmode):
+    mdstat, = guest(installed, disktype, bootmode, diskmode, ["cat /proc/mdstat"])
+    assert 'raid1' in mdstat
+    assert '[UU]' in mdstat, mdstat
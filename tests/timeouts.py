@@ -0,0 +1,92 @@
+import os
+import platform
+
+from benchmark import percentile
+
+CACHE_KEY = 'installer/phase-durations'
+# durations kept per phase
+KEEP = 50
+# samples needed before the history is trusted over the default
+MIN_SAMPLES = 5
+# never wait less than this for anything
+MINIMUM = 2.0
+# weight of the latest test in the session slowdown
+ALPHA = 0.3
+# how much slower than kvm/hvf an emulated guest is assumed to be
+ACCEL_FACTOR = {'tcg': 8.0}
+
+
+def host_key(arch, accel):
+    return f"{platform.node()}/{arch}/{accel}"
+
+
+def host_load():
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return 1.0
+    return max(load, 1.0)
+
+
+class TimeoutModel:
+    def __init__(self, config):
+        self.config = config
+        self.enabled = config.getoption("adaptive_timeouts")
+        self.factor = config.getoption("--timeout-factor")
+        self.history = {}
+        if getattr(config, 'cache', None) is not None:
+            self.history = config.cache.get(CACHE_KEY, {})
+        self.slowdown = {}
+        self.observed = {}
+        self.failed = set()
+
+    def scale(self, key, history=False):
+        # the recorded durations already are per accelerator, the defaults are for kvm
+        accel = 1.0 if history else ACCEL_FACTOR.get(key.rsplit('/', 1)[-1], 1.0)
+        return max(accel * host_load(), self.slowdown.get(key, 1.0))
+
+    def budget(self, key, default, phase=None):
+        if not self.enabled:
+            return default
+        if default is None or default == -1:
+            return default
+        durations = self.history.get(key, {}).get(phase, [])
+        if len(durations) < MIN_SAMPLES:
+            return max(default * self.scale(key), MINIMUM)
+        return max(self.factor * percentile(durations, 95) * self.scale(key, history=True),
+                   MINIMUM)
+
+    def observe(self, key, phases):
+        # how much slower this session is than the recorded medians
+        ratios = []
+        for phase in phases:
+            durations = self.history.get(key, {}).get(phase['name'], [])
+            if len(durations) >= MIN_SAMPLES and percentile(durations, 50) > 0:
+                ratios.append(phase['duration'] / percentile(durations, 50))
+        if ratios:
+            ratio = sorted(ratios)[len(ratios) // 2]
+            old = self.slowdown.get(key, ratio)
+            self.slowdown[key] = ALPHA * ratio + (1 - ALPHA) * old
+
+    def pytest_runtest_logreport(self, report):
+        if hasattr(self.config, 'workerinput'):
+            return
+        if report.failed:
+            # a failed test may have waited for a timeout, do not learn from it
+            self.failed.add(report.nodeid)
+        props = dict(report.user_properties)
+        if report.when != 'teardown' or 'vm' not in props or report.nodeid in self.failed:
+            return
+        phases = self.observed.setdefault(props['vm'], {})
+        for phase in props['phases']:
+            phases.setdefault(phase['name'], []).append(phase['duration'])
+
+    def pytest_sessionfinish(self, session):
+        if hasattr(self.config, 'workerinput') or getattr(self.config, 'cache', None) is None:
+            return
+        history = self.config.cache.get(CACHE_KEY, {})
+        for key, phases in self.observed.items():
+            stored = history.setdefault(key, {})
+            for name, durations in phases.items():
+                stored[name] = (stored.get(name, []) + durations)[-KEEP:]
+        self.config.cache.set(CACHE_KEY, history)
@@ -0,0 +1,132 @@
+import threading
+
+
+def live_config(item):
+    # what the first VM of a test marked live_vm boots with, None if it cannot be told
+    if item.get_closest_marker('live_vm') is None or getattr(item, 'callspec', None) is None:
+        return None
+    params = item.callspec.params
+    if not {'disktype', 'bootmode', 'numdisks'} <= params.keys():
+        return None
+    return (params.get('iso_file'), params['disktype'], params['bootmode'], params['numdisks'])
+
+
+class WarmVM:
+    # a live VM booted to the root prompt in the background
+    def __init__(self, vm, config, disktype, bootmode, alpine_conf_iso):
+        self.vm = vm
+        self.config = config
+        self.key = vm.live_key(disktype, bootmode, alpine_conf_iso)
+        self.p = None
+        self.error = None
+        self.thread = threading.Thread(target=self.boot,
+                                       args=(disktype, bootmode, alpine_conf_iso), daemon=True)
+        self.thread.start()
+
+    def boot(self, disktype, bootmode, alpine_conf_iso):
+        try:
+            p = self.vm.spawn(self.vm.live_args(disktype, bootmode, alpine_conf_iso))
+            self.p = self.vm.live_login(p, alpine_conf_iso)
+        except Exception as e:
+            self.error = e
+
+    def ready(self):
+        self.thread.join()
+        return self.error is None
+
+    def discard(self):
+        self.thread.join()
+        self.vm.release()
+        self.vm.remove_disks()
+        self.vm.save_apk_cache()
+
+
+class WarmPool:
+    def __init__(self, session, path, size):
+        self.session = session
+        self.path = path
+        self.size = size
+        self.vms = []
+        self.discarding = []
+        self.count = 0
+        self.taken = 0
+        self.discarded = 0
+
+    def upcoming(self, item):
+        items = self.session.items
+        start = items.index(item) + 1 if item in items else len(items)
+        return items[start:]
+
+    def prefetch(self, item, make_vm, arch, xen, alpine_conf_iso):
+        callspec = getattr(item, 'callspec', None)
+        iso = callspec.params.get('iso_file') if callspec is not None else None
+        current = live_config(item)
+        upcoming = []
+        for nextitem in self.upcoming(item):
+            if len(upcoming) == self.size:
+                break
+            config = live_config(nextitem)
+            if config is None or config[0] != iso:
+                continue
+            unsupported = getattr(nextitem.module, 'unsupported', None)
+            if unsupported is not None and unsupported(arch, xen, **nextitem.callspec.params):
+                continue
+            upcoming.append(config)
+
+        # keep what this test and the next ones can use
+        missing = ([current] if current is not None else []) + upcoming
+        keep = []
+        for warm in self.vms:
+            if warm.config in missing:
+                missing.remove(warm.config)
+                keep.append(warm)
+            else:
+                self.discard(warm)
+        self.vms = keep
+        if current in missing:
+            # too late to boot ahead for the running test
+            missing.remove(current)
+
+        for config in missing:
+            _, disktype, bootmode, numdisks = config
+            self.count += 1
+            path = self.path / f"vm{self.count}"
+            path.mkdir()
+            vm = make_vm(path, numdisks)
+            # only with room to spare, the running tests come first
+            if not vm.reserve(wait=False):
+                vm.remove_disks()
+                break
+            self.vms.append(WarmVM(vm, config, disktype, bootmode, alpine_conf_iso))
+
+    def discard(self, warm):
+        # in the background, it may still be booting
+        thread = threading.Thread(target=warm.discard, daemon=True)
+        thread.start()
+        self.discarding.append(thread)
+        self.discarded += 1
+
+    def take(self, key):
+        # waiting for one that is still booting beats booting another
+        for warm in self.vms:
+            if warm.key == key:
+                self.vms.remove(warm)
+                if warm.ready():
+                    self.taken += 1
+                    return warm
+                self.discard(warm)
+                return None
+        return None
+
+    def close(self):
+        for warm in self.vms:
+            self.discard(warm)
+        self.vms = []
+        for thread in self.discarding:
+            thread.join()
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.count:
+            terminalreporter.write_line(
+                f"warm pool: booted {self.count} VM(s) ahead, {self.taken} used, "
+                f"{self.discarded} discarded")